@@ -1,15 +1,129 @@
+import hashlib
 import logging
 import os
 import json
-from peewee import Model, SqliteDatabase, AutoField, CharField, TextField, SQL
-from typing import Optional
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from peewee import (
+    Model,
+    SqliteDatabase,
+    AutoField,
+    BigIntegerField,
+    CharField,
+    CompositeKey,
+    TextField,
+    SQL,
+)
+from typing import Iterable, Optional
+
+from pdf2zh.config import ConfigManager
 
 
 # we don't init the database here
 db = SqliteDatabase(None)
 logger = logging.getLogger(__name__)
 
+# Stay below SQLITE_MAX_VARIABLE_NUMBER (999 before SQLite 3.32)
+MAX_VARIABLES = 900
+
+
+def _digest(*parts: str) -> int:
+    """64-bit signed digest, stored as a SQLite INTEGER key."""
+    h = hashlib.blake2b(digest_size=8)
+    for part in parts:
+        h.update(part.encode("utf-8", "surrogatepass"))
+        h.update(b"\0")
+    return int.from_bytes(h.digest(), "big", signed=True)
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU bounded by number of entries and by bytes."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _sizeof(key: tuple, value: str) -> int:
+        return sys.getsizeof(key[-1]) + sys.getsizeof(value)
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: tuple, value: str):
+        size = self._sizeof(key, value)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= self._sizeof(key, old)
+            if size > self.max_bytes or self.max_entries <= 0:
+                return
+            self.entries[key] = value
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                k, v = self.entries.popitem(last=False)
+                self.size -= self._sizeof(k, v)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.hits = 0
+            self.misses = 0
 
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+                "bytes": self.size,
+            }
+
+
+# Shared by all TranslationCache instances, in front of the SQLite database
+memory_cache = LRUCache(
+    int(ConfigManager.get("CACHE_MEMORY_ENTRIES") or 100_000),
+    int(ConfigManager.get("CACHE_MEMORY_BYTES") or 64 * 1024 * 1024),
+)
+
+
+class _TranslationParams(Model):
+    key = BigIntegerField(primary_key=True)
+    translate_engine = CharField(max_length=20)
+    translate_engine_params = TextField()
+
+    class Meta:
+        database = db
+
+
+class _TranslationCacheV2(Model):
+    params_key = BigIntegerField()
+    text_key = BigIntegerField()
+    original_text = TextField()
+    translation = TextField()
+
+    class Meta:
+        database = db
+        primary_key = CompositeKey("params_key", "text_key")
+        without_rowid = True
+
+
+# Schema of cache.v1.db, only used for the migration
 class _TranslationCache(Model):
     id = AutoField()
     translate_engine = CharField(max_length=20)
@@ -62,6 +176,16 @@ class TranslationCache:
         self.params = params
         params = self._sort_dict_recursively(params)
         self.translate_engine_params = json.dumps(params)
+        self.params_key = _digest(self.translate_engine, self.translate_engine_params)
+        self.params_saved = False
+
+    def _save_params(self):
+        if self.params_saved:
+            return
+        backend.save_params(
+            self.params_key, self.translate_engine, self.translate_engine_params
+        )
+        self.params_saved = True
 
     def update_params(self, params: dict = None):
         if params is None:
@@ -73,35 +197,266 @@ class TranslationCache:
         self.params[k] = v
         self.replace_params(self.params)
 
-    # Since peewee and the underlying sqlite are thread-safe,
+    # Since the memory cache and the backends are thread-safe,
     # get and set operations don't need locks.
     def get(self, original_text: str) -> Optional[str]:
-        result = _TranslationCache.get_or_none(
-            translate_engine=self.translate_engine,
-            translate_engine_params=self.translate_engine_params,
-            original_text=original_text,
-        )
-        return result.translation if result else None
+        translation = memory_cache.get((self.params_key, original_text))
+        if translation is not None:
+            return translation
+        translation = backend.get(self.params_key, original_text)
+        if translation is not None:
+            memory_cache.put((self.params_key, original_text), translation)
+        return translation
 
     def set(self, original_text: str, translation: str):
+        memory_cache.put((self.params_key, original_text), translation)
         try:
-            _TranslationCache.create(
-                translate_engine=self.translate_engine,
-                translate_engine_params=self.translate_engine_params,
-                original_text=original_text,
-                translation=translation,
-            )
+            self._save_params()
+            backend.set(self.params_key, original_text, translation)
+        except Exception as e:
+            logger.debug(f"Error setting cache: {e}")
+
+    def get_many(self, original_texts: Iterable[str]) -> dict[str, str]:
+        """Look up several texts at once, returns the cached ones only."""
+        result = {}
+        missing = []
+        for text in dict.fromkeys(original_texts):
+            translation = memory_cache.get((self.params_key, text))
+            if translation is not None:
+                result[text] = translation
+            else:
+                missing.append(text)
+        if missing:
+            found = backend.get_many(self.params_key, missing)
+            for original_text, translation in found.items():
+                memory_cache.put((self.params_key, original_text), translation)
+            result.update(found)
+        return result
+
+    def set_many(self, pairs: Iterable[tuple[str, str]]):
+        """Store several translations at once."""
+        pairs = list(pairs)
+        for original_text, translation in pairs:
+            memory_cache.put((self.params_key, original_text), translation)
+        try:
+            self._save_params()
+            backend.set_many(self.params_key, pairs)
         except Exception as e:
             logger.debug(f"Error setting cache: {e}")
 
 
+class CacheBackend:
+    """
+    Persistent storage behind TranslationCache. Entries are grouped by
+    ``params_key``, the digest of the translate engine and its params.
+    """
+
+    def save_params(
+        self, params_key: int, translate_engine: str, translate_engine_params: str
+    ):
+        raise NotImplementedError
+
+    def get_many(self, params_key: int, original_texts: list[str]) -> dict[str, str]:
+        raise NotImplementedError
+
+    def set_many(self, params_key: int, pairs: list[tuple[str, str]]):
+        raise NotImplementedError
+
+    def get(self, params_key: int, original_text: str) -> Optional[str]:
+        return self.get_many(params_key, [original_text]).get(original_text)
+
+    def set(self, params_key: int, original_text: str, translation: str):
+        self.set_many(params_key, [(original_text, translation)])
+
+
+class SQLiteBackend(CacheBackend):
+    """Per-user SQLite file, the models are bound to the module level ``db``."""
+
+    def save_params(
+        self, params_key: int, translate_engine: str, translate_engine_params: str
+    ):
+        _TranslationParams.insert(
+            key=params_key,
+            translate_engine=translate_engine,
+            translate_engine_params=translate_engine_params,
+        ).on_conflict_ignore().execute()
+
+    def get(self, params_key: int, original_text: str) -> Optional[str]:
+        result = _TranslationCacheV2.get_or_none(
+            params_key=params_key,
+            text_key=_digest(original_text),
+        )
+        # The text is stored along with its digest to rule out collisions
+        if result and result.original_text == original_text:
+            return result.translation
+        return None
+
+    def get_many(self, params_key: int, original_texts: list[str]) -> dict[str, str]:
+        keys = {_digest(text): text for text in original_texts}
+        key_list = list(keys)
+        result = {}
+        # One variable is taken by params_key
+        for i in range(0, len(key_list), MAX_VARIABLES - 1):
+            chunk = key_list[i : i + MAX_VARIABLES - 1]
+            query = _TranslationCacheV2.select(
+                _TranslationCacheV2.text_key,
+                _TranslationCacheV2.original_text,
+                _TranslationCacheV2.translation,
+            ).where(
+                (_TranslationCacheV2.params_key == params_key)
+                & (_TranslationCacheV2.text_key.in_(chunk))
+            )
+            for text_key, original_text, translation in query.tuples():
+                if keys[text_key] == original_text:
+                    result[original_text] = translation
+        return result
+
+    def set_many(self, params_key: int, pairs: list[tuple[str, str]]):
+        rows = [
+            (params_key, _digest(original_text), original_text, translation)
+            for original_text, translation in pairs
+        ]
+        # A single transaction for all rows
+        with _TranslationCacheV2._meta.database.atomic():
+            _insert_rows(rows)
+
+
+class RedisBackend(CacheBackend):
+    """
+    Redis store shared by several workers. Each params_key is one hash that maps
+    the digest of a text to ``[original_text, translation]``.
+    """
+
+    prefix = "pdf2zh:cache"
+
+    def __init__(self, url: str = None, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                logger.warning(
+                    "redis is not installed, if you want to use the redis cache backend, please install it."
+                )
+                raise
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def _name(self, params_key: int) -> str:
+        return f"{self.prefix}:{params_key}"
+
+    def save_params(
+        self, params_key: int, translate_engine: str, translate_engine_params: str
+    ):
+        value = json.dumps([translate_engine, translate_engine_params])
+        self.client.hsetnx(f"{self.prefix}:params", str(params_key), value)
+
+    def get_many(self, params_key: int, original_texts: list[str]) -> dict[str, str]:
+        fields = [str(_digest(text)) for text in original_texts]
+        values = self.client.hmget(self._name(params_key), fields)
+        result = {}
+        for text, value in zip(original_texts, values):
+            if value is None:
+                continue
+            original_text, translation = json.loads(value)
+            if original_text == text:
+                result[text] = translation
+        return result
+
+    def set_many(self, params_key: int, pairs: list[tuple[str, str]]):
+        if not pairs:
+            return
+        mapping = {
+            str(_digest(original_text)): json.dumps([original_text, translation])
+            for original_text, translation in pairs
+        }
+        self.client.hset(self._name(params_key), mapping=mapping)
+
+
+# Selected by init_backend
+backend: CacheBackend = SQLiteBackend()
+
+
+def _insert_rows(rows: list[tuple]):
+    fields = [
+        _TranslationCacheV2.params_key,
+        _TranslationCacheV2.text_key,
+        _TranslationCacheV2.original_text,
+        _TranslationCacheV2.translation,
+    ]
+    # Four variables per row
+    for i in range(0, len(rows), MAX_VARIABLES // 4):
+        chunk = rows[i : i + MAX_VARIABLES // 4]
+        _TranslationCacheV2.insert_many(chunk, fields).on_conflict_replace().execute()
+
+
+def migrate_v1(v1_path: str, v2_db: SqliteDatabase, batch_size: int = 10000):
+    """Copy the entries of a cache.v1.db into the (empty) v2 database."""
+    params_keys = {}
+    v1 = sqlite3.connect(v1_path)
+    try:
+        cursor = v1.execute(
+            "SELECT translate_engine, translate_engine_params, original_text, translation "
+            "FROM _translationcache ORDER BY id"
+        )
+        with v2_db.atomic():
+            while rows := cursor.fetchmany(batch_size):
+                batch = []
+                for engine, params, original_text, translation in rows:
+                    key = params_keys.get((engine, params))
+                    if key is None:
+                        key = params_keys[(engine, params)] = _digest(engine, params)
+                        _TranslationParams.insert(
+                            key=key,
+                            translate_engine=engine,
+                            translate_engine_params=params,
+                        ).on_conflict_ignore().execute()
+                    text_key = _digest(original_text)
+                    batch.append((key, text_key, original_text, translation))
+                _insert_rows(batch)
+    finally:
+        v1.close()
+
+
+def _remove_db_files(db_path: str):
+    for path in (db_path, db_path + "-wal", db_path + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
 def init_db(remove_exists=False):
     cache_folder = os.path.join(os.path.expanduser("~"), ".cache", "pdf2zh")
     os.makedirs(cache_folder, exist_ok=True)
-    # The current version does not support database migration, so add the version number to the file name.
-    cache_db_path = os.path.join(cache_folder, "cache.v1.db")
-    if remove_exists and os.path.exists(cache_db_path):
-        os.remove(cache_db_path)
+    # Add the version number to the file name, older versions are migrated once.
+    cache_db_path = os.path.join(cache_folder, "cache.v2.db")
+    v1_db_path = os.path.join(cache_folder, "cache.v1.db")
+    if remove_exists:
+        # Remove the v1 cache too, otherwise its entries would be migrated back
+        _remove_db_files(cache_db_path)
+        _remove_db_files(v1_db_path)
+        memory_cache.clear()
+    if not os.path.exists(cache_db_path) and os.path.exists(v1_db_path):
+        # Migrate into a temporary file first, so an interrupted migration is retried.
+        # The file is per process, concurrent migrations must not share it.
+        tmp_db_path = f"{cache_db_path}.{os.getpid()}.tmp"
+        _remove_db_files(tmp_db_path)
+        tmp_db = SqliteDatabase(tmp_db_path)
+        try:
+            with tmp_db.bind_ctx([_TranslationParams, _TranslationCacheV2]):
+                tmp_db.create_tables([_TranslationParams, _TranslationCacheV2])
+                migrate_v1(v1_db_path, tmp_db)
+            tmp_db.close()
+            try:
+                # A hard link is created atomically and fails if the target exists,
+                # so a database another process already uses is never replaced
+                os.link(tmp_db_path, cache_db_path)
+                logger.info(f"Migrated translation cache to {cache_db_path}")
+            except FileExistsError:
+                pass
+            _remove_db_files(tmp_db_path)
+        except Exception as e:
+            tmp_db.close()
+            _remove_db_files(tmp_db_path)
+            logger.warning(f"Failed to migrate translation cache {v1_db_path}: {e}")
     db.init(
         cache_db_path,
         pragmas={
@@ -109,12 +464,15 @@ def init_db(remove_exists=False):
             "busy_timeout": 1000,
         },
     )
-    db.create_tables([_TranslationCache], safe=True)
+    db.create_tables([_TranslationParams, _TranslationCacheV2], safe=True)
 
 
 def init_test_db():
     import tempfile
 
+    global backend
+    backend = SQLiteBackend()
+    memory_cache.clear()
     cache_db_path = tempfile.mktemp(suffix=".db")
     test_db = SqliteDatabase(
         cache_db_path,
@@ -123,24 +481,32 @@ def init_test_db():
             "busy_timeout": 1000,
         },
     )
-    test_db.bind([_TranslationCache], bind_refs=False, bind_backrefs=False)
+    test_db.bind(
+        [_TranslationParams, _TranslationCacheV2], bind_refs=False, bind_backrefs=False
+    )
     test_db.connect()
-    test_db.create_tables([_TranslationCache], safe=True)
+    test_db.create_tables([_TranslationParams, _TranslationCacheV2], safe=True)
     return test_db
 
 
 def clean_test_db(test_db):
-    test_db.drop_tables([_TranslationCache])
+    test_db.drop_tables([_TranslationParams, _TranslationCacheV2])
     test_db.close()
-    db_path = test_db.database
-    if os.path.exists(db_path):
-        os.remove(test_db.database)
-    wal_path = db_path + "-wal"
-    if os.path.exists(wal_path):
-        os.remove(wal_path)
-    shm_path = db_path + "-shm"
-    if os.path.exists(shm_path):
-        os.remove(shm_path)
-
-
-init_db()
+    _remove_db_files(test_db.database)
+
+
+def init_backend():
+    """Select the cache backend from the ``CACHE_BACKEND`` config, sqlite by default."""
+    global backend
+    name = ConfigManager.get("CACHE_BACKEND") or "sqlite"
+    if name == "sqlite":
+        backend = SQLiteBackend()
+        init_db()
+    elif name == "redis":
+        url = ConfigManager.get("CACHE_REDIS_URL") or "redis://127.0.0.1:6379/0"
+        backend = RedisBackend(url)
+    else:
+        raise ValueError(f"Unsupported cache backend: {name}")
+
+
+init_backend()
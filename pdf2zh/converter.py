@@ -1,18 +1,28 @@
+import asyncio
 import concurrent.futures
+import hashlib
 import logging
+import os
 import re
+import threading
 import unicodedata
 from enum import Enum
 from string import Template
-from typing import Dict
+from typing import Dict, Optional
 
 import numpy as np
 from pdfminer.converter import PDFConverter
-from pdfminer.layout import LTChar, LTFigure, LTLine, LTPage
-from pdfminer.pdffont import PDFCIDFont, PDFUnicodeNotDefined
+from pdfminer.fontmetrics import FONT_METRICS
+from pdfminer.layout import LTFigure, LTLine, LTPage
+from pdfminer.pdffont import (
+    PDFCIDFont,
+    PDFFont,
+    PDFType1Font,
+    PDFUnicodeNotDefined,
+)
 from pdfminer.pdfinterp import PDFGraphicState, PDFResourceManager
 from pdfminer.utils import apply_matrix_pt, mult_matrix
-from pymupdf import Font
+from pymupdf import Font, VersionBind
 from tenacity import retry, wait_fixed
 
 from pdf2zh.translator import (
@@ -50,6 +60,8 @@ class PDFConverterEx(PDFConverter):
         rsrcmgr: PDFResourceManager,
     ) -> None:
         PDFConverter.__init__(self, rsrcmgr, None, "utf-8", 1, None)
+        # 每个字体已解析的字符 cid -> (text, textwidth, textdisp)，整个文档共用
+        self.glyphs: dict[PDFFont, dict[int, tuple]] = {}
 
     def begin_page(self, page, ctm) -> None:
         # 重载替换 cropbox
@@ -88,31 +100,95 @@ class PDFConverterEx(PDFConverter):
         ncs,
         graphicstate: PDFGraphicState,
     ) -> float:
-        # 重载设置 cid 和 font
-        try:
-            text = font.to_unichr(cid)
-            assert isinstance(text, str), str(type(text))
-        except PDFUnicodeNotDefined:
-            text = self.handle_undefined_char(font, cid)
-        textwidth = font.char_width(cid)
-        textdisp = font.char_disp(cid)
-        item = LTChar(
-            matrix,
-            font,
-            fontsize,
-            scaling,
-            rise,
-            text,
-            textwidth,
-            textdisp,
-            ncs,
-            graphicstate,
+        # 重载使用轻量的 Char 代替 LTChar，并记录 cid 和 font
+        text, textwidth, textdisp = self.glyph(font, cid)
+        item = Char(
+            matrix, font, fontsize, scaling, rise, text, textwidth, textdisp, cid
         )
         self.cur_item.add(item)
-        item.cid = cid  # hack 插入原字符编码
-        item.font = font  # hack 插入原字符字体
         return item.adv
 
+    def glyph(self, font: PDFFont, cid: int) -> tuple:
+        """Text, width and displacement of a character, resolved once per font and cid."""
+        glyphs = self.glyphs.get(font)
+        if glyphs is None:
+            glyphs = self.glyphs[font] = {}
+        glyph = glyphs.get(cid)
+        if glyph is None:
+            try:
+                text = font.to_unichr(cid)
+                assert isinstance(text, str), str(type(text))
+            except PDFUnicodeNotDefined:
+                text = self.handle_undefined_char(font, cid)  # 未定义的字符同样缓存
+            glyph = glyphs[cid] = (text, font.char_width(cid), font.char_disp(cid))
+        return glyph
+
+
+class Char:
+    """
+    A drawn character, with the fields of ``LTChar`` that the converter reads and the
+    same geometry, without the layout analysis state.
+    """
+
+    __slots__ = (
+        "x0",
+        "y0",
+        "x1",
+        "y1",
+        "width",
+        "size",
+        "adv",
+        "matrix",
+        "fontname",
+        "font",
+        "cid",
+        "_text",
+    )
+
+    def __init__(
+        self,
+        matrix,
+        font: PDFFont,
+        fontsize: float,
+        scaling: float,
+        rise: float,
+        text: str,
+        textwidth: float,
+        textdisp,
+        cid: int,
+    ) -> None:
+        self._text = text
+        self.matrix = matrix
+        self.font = font  # 原字符字体
+        self.fontname = font.fontname
+        self.cid = cid  # 原字符编码
+        self.adv = textwidth * fontsize * scaling
+        # 与 LTChar 相同的包围盒计算
+        vertical = font.is_vertical()
+        if vertical:
+            (vx, vy) = textdisp
+            if vx is None:
+                vx = fontsize * 0.5
+            else:
+                vx = vx * fontsize * 0.001
+            vy = (1000 - vy) * fontsize * 0.001
+            (x0, y0) = apply_matrix_pt(matrix, (-vx, vy + rise + self.adv))
+            (x1, y1) = apply_matrix_pt(matrix, (-vx + fontsize, vy + rise))
+        else:
+            descent = font.get_descent() * fontsize
+            (x0, y0) = apply_matrix_pt(matrix, (0, descent + rise))
+            (x1, y1) = apply_matrix_pt(matrix, (self.adv, descent + rise + fontsize))
+        if x1 < x0:
+            (x0, x1) = (x1, x0)
+        if y1 < y0:
+            (y0, y1) = (y1, y0)
+        self.x0, self.y0, self.x1, self.y1 = x0, y0, x1, y1
+        self.width = x1 - x0
+        self.size = self.width if vertical else y1 - y0
+
+    def get_text(self) -> str:
+        return self._text
+
 
 class Paragraph:
     def __init__(self, y, x, x0, x1, y0, y1, size, brk):
@@ -126,6 +202,267 @@ class Paragraph:
         self.brk: bool = brk  # 换行标记
 
 
+class ParsedLayout:
+    def __init__(self, sstk, pstk, var, varl, varf, vlen, lstk, fontmap, fontid):
+        self.sstk: list[str] = sstk                 # 段落文字栈
+        self.pstk: list[Paragraph] = pstk           # 段落属性栈
+        self.var: list[list[Char]] = var            # 公式符号组栈
+        self.varl: list[list[LTLine]] = varl        # 公式线条组栈
+        self.varf: list[float] = varf               # 公式纵向偏移栈
+        self.vlen: list[float] = vlen               # 公式宽度栈
+        self.lstk: list[LTLine] = lstk              # 全局线条栈
+        self.fontmap: dict = fontmap                # 解析时的字体表，排版可能晚于下一页的解析
+        self.fontid: dict = fontid                  # 解析时的字体 ID 表
+
+
+class PendingOps:
+    """Typeset ops of a parsed layout that are waiting for its translations."""
+
+    def __init__(self, converter, parsed: ParsedLayout, futures: list):
+        self.converter = converter
+        self.parsed = parsed
+        self.futures: list[concurrent.futures.Future] = futures
+        self.ops: bytes = None
+        self.error: Exception = None
+
+    def done(self) -> bool:
+        return self.futures is None or all(f.done() for f in self.futures)
+
+    def finish(self) -> None:
+        # 翻译全部完成后排版，只执行一次
+        if self.futures is None:
+            return
+        try:
+            news = [f.result() for f in self.futures]
+            self.ops = self.converter.typeset(self.parsed, news)
+        except Exception as e:
+            self.error = e
+        self.parsed = self.futures = None
+
+    def result(self) -> bytes:
+        self.finish()
+        if self.error is not None:
+            raise self.error
+        return self.ops
+
+
+# 默认的公式字体：latex 字体
+LATEX_FONTS = r"(CM[^R]|MS.M|XY|MT|BL|RM|EU|LA|RS|LINE|LCIRCLE|TeX-|rsfs|txsy|wasy|stmary|.*Mono|.*Code|.*Ital|.*Sym|.*Math)"
+# 译文中的 {vn} 公式标记
+FORMULA_MARK = re.compile(r"\{\s*v([\d\s]+)\}", re.IGNORECASE)
+
+
+def tokenize(text: str) -> list:
+    """Split a translation into its characters and ``{vn}`` formula marks (match objects)."""
+    tokens = []
+    pos = 0
+    for mark in FORMULA_MARK.finditer(text):
+        tokens.extend(text[pos : mark.start()])
+        tokens.append(mark)
+        pos = mark.end()
+    tokens.extend(text[pos:])
+    return tokens
+
+
+def font_metrics_path(font_path: str) -> str:
+    """Path of the saved metrics of a font file, next to it if that folder is writable."""
+    stat = os.stat(font_path)
+    key = repr(
+        (os.path.abspath(font_path), stat.st_size, stat.st_mtime_ns, VersionBind)
+    )
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(font_path))[0]
+    folder = os.path.dirname(os.path.abspath(font_path))
+    if not os.access(folder, os.W_OK):
+        folder = os.path.join(os.path.expanduser("~"), ".cache", "pdf2zh", "fonts")
+    return os.path.join(folder, f"{name}.{digest}.metrics.npz")
+
+
+class FontMetrics:
+    """
+    Glyph ids and advances at size 1 of an output font by code point. With a font file
+    the BMP is computed in one pass and saved next to it, other code points on demand.
+    """
+
+    BMP = 0x10000
+
+    def __init__(self, font: Font, path: str = ""):
+        self.font = font
+        self.glyphs: list[int] = []
+        self.advances: list[float] = []
+        self.extra: dict[int, tuple] = {}
+        if path:
+            self.load(path)
+
+    def load(self, path: str):
+        metrics_path = font_metrics_path(path)
+        try:
+            with np.load(metrics_path) as data:
+                self.glyphs = data["glyphs"].tolist()
+                self.advances = data["advances"].tolist()
+            return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            log.warning(f"Failed to load font metrics {metrics_path}: {e}")
+        self.glyphs = [self.font.has_glyph(c) for c in range(self.BMP)]
+        self.advances = [self.font.glyph_advance(c) for c in range(self.BMP)]
+        try:
+            os.makedirs(os.path.dirname(metrics_path), exist_ok=True)
+            # 多个进程可能同时生成，先写入临时文件
+            tmp_path = f"{metrics_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    glyphs=np.array(self.glyphs, dtype=np.int32),
+                    advances=np.array(self.advances, dtype=np.float64),
+                )
+            os.replace(tmp_path, metrics_path)
+        except OSError as e:
+            log.warning(f"Failed to save font metrics {metrics_path}: {e}")
+
+    def lookup(self, code: int) -> tuple:
+        metrics = self.extra.get(code)
+        if metrics is None:
+            metrics = self.extra[code] = (
+                self.font.has_glyph(code),
+                self.font.glyph_advance(code),
+            )
+        return metrics
+
+    def glyph(self, code: int) -> int:
+        if code < len(self.glyphs):
+            return self.glyphs[code]
+        return self.lookup(code)[0]
+
+    def advance(self, code: int) -> float:
+        if code < len(self.advances):
+            return self.advances[code]
+        return self.lookup(code)[1]
+
+
+_font_metrics: dict[str, FontMetrics] = {}
+_font_metrics_lock = threading.Lock()
+
+
+def font_metrics(font: Font, path: str = "") -> FontMetrics:
+    """The FontMetrics of a font file, shared by the whole process."""
+    if not path:
+        return FontMetrics(font)
+    key = os.path.abspath(path)
+    with _font_metrics_lock:
+        if key not in _font_metrics:
+            _font_metrics[key] = FontMetrics(font, path)
+        return _font_metrics[key]
+
+
+def pdf_number(value: float, precision: int = 6) -> bytes:
+    """A content stream number rounded to ``precision``, without trailing zeros."""
+    number = (b"%.*f" % (precision, value)).rstrip(b"0").rstrip(b".")
+    return b"0" if number == b"-0" else number
+
+
+def glyph_advance(font: PDFFont, cid: int) -> Optional[float]:
+    """
+    Advance at size 1 of a glyph of a source font, when pdfminer read it from the
+    Widths of a simple font and every viewer agrees on it. None otherwise.
+    """
+    if not isinstance(font, PDFType1Font) or font.basefont in FONT_METRICS:
+        return None  # 标准 14 字体的字宽来自 pdfminer 自带的度量，与阅读器未必一致
+    width = font.widths.get(cid)
+    if not isinstance(width, (int, float)) or width <= 0:
+        return None  # 缺少 Widths 时 pdfminer 按 0 处理
+    if width != int(width):
+        return None  # 有的阅读器（如 MuPDF）会把小数字宽取整
+    return width * font.hscale
+
+
+class OpsWriter:
+    """
+    Content stream operators for typeset text and lines. The text state is kept
+    between runs, so fonts are only set when they change and positions are relative
+    ``Td`` moves. Strings on one baseline whose advance is known share a ``TJ`` array,
+    the gaps between them become kerning.
+    """
+
+    def __init__(self) -> None:
+        self.ops: list[bytes] = [b"BT "]
+        self.font: tuple = None  # 当前字体和字号
+        self.x, self.y = 0.0, 0.0  # 当前行起点，Td 相对于它移动
+        self.strings: list[bytes] = []  # 待输出的 TJ 数组，字符串与字距交替
+        self.pen: Optional[float] = None  # TJ 数组之后的横坐标，None 表示不能续接
+        self.linewidth: bytes = None  # 正在绘制线条时的线宽，None 表示处于文字对象中
+
+    def text(
+        self,
+        font: str,
+        size: float,
+        x: float,
+        y: float,
+        raw: bytes,
+        adv: Optional[float] = None,
+    ) -> None:
+        """Show the hex string ``raw`` at (x, y), ``adv`` is its advance at size 1."""
+        key = (font, pdf_number(size))
+        if self.pen is not None and key == self.font and pdf_number(y - self.y) == b"0":
+            kern = pdf_number((self.pen - x) * 1000 / size, 3)
+            if kern == b"0":
+                self.strings[-1] += raw
+            else:
+                self.strings += [kern, raw]
+            x = self.pen - float(kern) * size / 1000
+        else:
+            self.flush()
+            if self.linewidth is not None:
+                self.ops.append(b"Q BT ")
+                self.linewidth = None
+                self.x, self.y = 0.0, 0.0  # BT 重置行起点，字体在 Q 之后仍然有效
+            if key != self.font:
+                self.ops.append(b"/%s %s Tf " % (font.encode(), key[1]))
+                self.font = key
+            dx, dy = pdf_number(x - self.x), pdf_number(y - self.y)
+            self.ops.append(b"%s %s Td " % (dx, dy))
+            self.x += float(dx)
+            self.y += float(dy)
+            x = self.x
+            self.strings = [raw]
+        self.pen = None if adv is None else x + adv * size
+
+    def line(self, x: float, y: float, xlen: float, ylen: float, linewidth: float):
+        self.flush()
+        if self.linewidth is None:
+            self.ops.append(b"ET q [] 0 d 0 J ")
+        width = pdf_number(linewidth)
+        if width != self.linewidth:
+            self.ops.append(b"%s w " % width)
+            self.linewidth = width
+        self.ops.append(
+            b"%s %s m %s %s l S "
+            % (
+                pdf_number(x),
+                pdf_number(y),
+                pdf_number(x + xlen),
+                pdf_number(y + ylen),
+            )
+        )
+
+    def flush(self) -> None:
+        if len(self.strings) == 1:
+            self.ops.append(b"<%s> Tj " % self.strings[0])
+        elif self.strings:
+            array = b"".join(
+                item if i % 2 else b"<%s>" % item for i, item in enumerate(self.strings)
+            )
+            self.ops.append(b"[%s] TJ " % array)
+        self.strings = []
+        self.pen = None
+
+    def getvalue(self) -> bytes:
+        self.flush()
+        self.ops.append(b"ET " if self.linewidth is None else b"Q ")
+        return b"".join(self.ops)
+
+
 # fmt: off
 class TranslateConverter(PDFConverterEx):
     def __init__(
@@ -143,14 +480,38 @@ class TranslateConverter(PDFConverterEx):
         envs: Dict = None,
         prompt: Template = None,
         ignore_cache: bool = False,
+        deferred: bool = False,
+        two_pass: bool = False,
+        concurrency: int = 0,
+        font_path: str = "",
     ) -> None:
         super().__init__(rsrcmgr)
         self.vfont = vfont
         self.vchar = vchar
+        # 正则只编译一次，判定结果按字体名和字符缓存，整个文档共用
+        self.vfont_re = re.compile(vfont or LATEX_FONTS)
+        self.vchar_re = re.compile(vchar) if vchar else None
+        self.vfont_cache: dict[str, bool] = {}
+        self.vchar_cache: dict[str, bool] = {}
         self.thread = thread
         self.layout = layout
+        self.deferred = deferred                # 延迟排版，receive_layout 返回 PendingOps
+        self.pending: list[PendingOps] = []     # 尚未排版的 PendingOps
+        self.executor: concurrent.futures.ThreadPoolExecutor = None  # 整个文档共用的翻译线程池
+        self.two_pass = two_pass                # 先解析全文，flush 时再统一翻译
+        self.work: dict[str, concurrent.futures.Future] = {}  # 文档级去重的翻译任务
+        self.queued: list[str] = []             # two_pass 模式下等待 flush 的原文
+        self.fontmap: dict = {}                 # 由 interpreter 在每次 end_page/end_figure 前设置
+        self.fontid: dict = {}
+        self.concurrency = concurrency          # >0 时使用 asyncio 事件循环发送请求，限制同时进行的请求数
+        self.loop: asyncio.AbstractEventLoop = None
+        self.loop_thread: threading.Thread = None
+        self.semaphore: asyncio.Semaphore = None
         self.noto_name = noto_name
         self.noto = noto
+        # 输出字体按码位查表：noto 的字形 ID 和字宽整个进程共用，tiro 的覆盖和字宽按字体缓存
+        self.noto_metrics: FontMetrics = font_metrics(noto, font_path) if noto is not None else None
+        self.tiro_cache: dict[PDFFont, dict[str, Optional[float]]] = {}
         self.translator: BaseTranslator = None
         # e.g. "ollama:gemma2:9b" -> ["ollama", "gemma2:9b"]
         param = service.split(":", 1)
@@ -165,74 +526,271 @@ class TranslateConverter(PDFConverterEx):
         if not self.translator:
             raise ValueError("Unsupported translation service")
 
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.ashutdown(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.loop_thread.join()
+            self.loop.close()
+            self.loop = self.loop_thread = None
+
+    async def ashutdown(self) -> None:
+        # 取消未完成的请求并关闭异步客户端
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.translator.aclose()
+
     def receive_layout(self, ltpage: LTPage):
+        parsed = self.parse_layout(ltpage)
+        pending = PendingOps(self, parsed, self.translate_paragraphs(parsed.sstk))
+        if self.deferred:
+            self.pending.append(pending)
+            return pending
+        return pending.result()
+
+    @retry(wait=wait_fixed(1))
+    def worker(self, s: str):  # 多线程翻译
+        if not s.strip() or re.match(r"^\{v\d+\}$", s):  # 空白和公式不翻译
+            return s
+        try:
+            new = self.translator.translate(s, ignore_cache=True)
+            return new
+        except BaseException as e:
+            if log.isEnabledFor(logging.DEBUG):
+                log.exception(e)
+            else:
+                log.exception(e, exc_info=False)
+            raise e
+
+    @retry(wait=wait_fixed(1))
+    def batch_worker(self, texts: list[str]):  # 批量翻译
+        try:
+            return self.translator.translate_batch(texts, ignore_cache=True)
+        except BaseException as e:
+            if log.isEnabledFor(logging.DEBUG):
+                log.exception(e)
+            else:
+                log.exception(e, exc_info=False)
+            raise e
+
+    @retry(wait=wait_fixed(1))
+    async def aworker(self, s: str):  # 异步翻译
+        try:
+            async with self.semaphore:
+                return await self.translator.atranslate(s, ignore_cache=True)
+        except Exception as e:
+            if log.isEnabledFor(logging.DEBUG):
+                log.exception(e)
+            else:
+                log.exception(e, exc_info=False)
+            raise e
+
+    @retry(wait=wait_fixed(1))
+    async def abatch_worker(self, texts: list[str]):  # 异步批量翻译
+        try:
+            async with self.semaphore:
+                return await self.translator.atranslate_batch(texts, ignore_cache=True)
+        except Exception as e:
+            if log.isEnabledFor(logging.DEBUG):
+                log.exception(e)
+            else:
+                log.exception(e, exc_info=False)
+            raise e
+
+    def translate_paragraphs(self, sstk: list[str]) -> list[concurrent.futures.Future]:
+        # 相同原文（页眉、页脚、图表标题等）在整个文档中只翻译一次
+        futures = []
+        texts = []
+        for s in sstk:
+            future = self.work.get(s)
+            if future is None:
+                future = self.work[s] = concurrent.futures.Future()
+                if not s.strip() or re.match(r"^\{v\d+\}$", s):  # 空白和公式不翻译
+                    future.set_result(s)
+                else:
+                    texts.append(s)
+            futures.append(future)
+        if self.two_pass:
+            self.queued.extend(texts)
+        else:
+            self.dispatch(texts)
+        return futures
+
+    def dispatch(self, texts: list[str]) -> None:
+        texts = self.prefetch(texts)
+        if not texts:
+            return
+        if self.concurrency > 0:
+            self.adispatch(texts)
+            return
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.thread)
+        if self.translator.batch_size > 1:  # 支持批量翻译的服务一次请求多个段落
+            for batch in self.translator.split_batches(texts):
+                self.executor.submit(self.fill_batch, batch)
+        else:
+            for s in texts:
+                self.executor.submit(self.fill, s, self.work[s])
+
+    def prefetch(self, texts: list[str]) -> list[str]:
+        # 一次查询取出缓存中已有的翻译，只有未命中的原文才发送请求
+        # 未命中的原文由 worker 以 ignore_cache 翻译，不再逐条查询缓存（译文仍会写入）
+        if not texts or self.translator.ignore_cache:
+            return texts
+        results, missing = self.translator.lookup_batch(texts)
+        for s, result in zip(texts, results):
+            if result is not None:
+                self.work[s].set_result(result)
+        return [texts[i] for i in missing]
+
+    def fill(self, s: str, future: concurrent.futures.Future) -> None:
+        try:
+            future.set_result(self.worker(s))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def fill_batch(self, texts: list[str]) -> None:
+        try:
+            translations = self.batch_worker(texts)
+            if len(translations) != len(texts):  # 少了译文会让等待的段落永远阻塞
+                raise ValueError(f"Expected {len(texts)} translations, got {len(translations)}")
+            for s, new in zip(texts, translations):
+                self.work[s].set_result(new)
+        except BaseException as e:
+            for s in texts:
+                if not self.work[s].done():
+                    self.work[s].set_exception(e)
+
+    def adispatch(self, texts: list[str]) -> None:
+        if self.loop is None:  # 整个文档共用一个事件循环，在后台线程中运行
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+            self.loop_thread.start()
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        if self.translator.batch_size > 1:
+            for batch in self.translator.split_batches(texts):
+                asyncio.run_coroutine_threadsafe(self.afill_batch(batch), self.loop)
+        else:
+            for s in texts:
+                asyncio.run_coroutine_threadsafe(self.afill(s, self.work[s]), self.loop)
+
+    async def afill(self, s: str, future: concurrent.futures.Future) -> None:
+        try:
+            future.set_result(await self.aworker(s))
+        except BaseException as e:
+            future.set_exception(e)
+
+    async def afill_batch(self, texts: list[str]) -> None:
+        try:
+            translations = await self.abatch_worker(texts)
+            if len(translations) != len(texts):  # 少了译文会让等待的段落永远阻塞
+                raise ValueError(f"Expected {len(texts)} translations, got {len(translations)}")
+            for s, new in zip(texts, translations):
+                self.work[s].set_result(new)
+        except BaseException as e:
+            for s in texts:
+                if not self.work[s].done():
+                    self.work[s].set_exception(e)
+
+    def flush(self) -> None:
+        # two_pass 模式：全文解析完成后统一提交翻译
+        queued, self.queued = self.queued, []
+        self.dispatch(queued)
+
+    def vflag(self, font: str, char: str) -> bool:  # 匹配公式（和角标）字体
+        flag = self.vfont_cache.get(font)
+        if flag is None:
+            flag = self.vfont_cache[font] = self.match_vfont(font)
+        if flag:
+            return True
+        flag = self.vchar_cache.get(char)
+        if flag is None:
+            flag = self.vchar_cache[char] = self.match_vchar(char)
+        return flag
+
+    def match_vfont(self, font: str) -> bool:
+        if isinstance(font, bytes):     # 不一定能 decode，直接转 str
+            try:
+                font = font.decode('utf-8')  # 尝试使用 UTF-8 解码
+            except UnicodeDecodeError:
+                font = ""
+        font = font.split("+")[-1]      # 字体名截断
+        # 基于字体名规则的判定
+        return bool(self.vfont_re.match(font))
+
+    def match_vchar(self, char: str) -> bool:
+        if char.startswith("(cid:"):
+            return True
+        # 基于字符集规则的判定
+        if self.vchar_re:
+            return bool(self.vchar_re.match(char))
+        return bool(
+            char
+            and char != " "                                     # 非空格
+            and (
+                unicodedata.category(char[0])
+                in ["Lm", "Mn", "Sk", "Sm", "Zl", "Zp", "Zs"]   # 文字修饰符、数学符号、分隔符号
+                or ord(char[0]) in range(0x370, 0x400)          # 希腊字母
+            )
+        )
+
+    def tiro_width(self, font: PDFFont, ch: str) -> Optional[float]:  # 拉丁字体的单位字宽，不支持的字符为 None
+        widths = self.tiro_cache.get(font)
+        if widths is None:
+            widths = self.tiro_cache[font] = {}
+        if ch not in widths:
+            try:
+                covered = font.to_unichr(ord(ch)) == ch
+            except Exception:
+                covered = False
+            widths[ch] = font.char_width(ord(ch)) if covered else None
+        return widths[ch]
+
+    def parse_layout(self, ltpage: LTPage) -> ParsedLayout:
         # 段落
         sstk: list[str] = []            # 段落文字栈
         pstk: list[Paragraph] = []      # 段落属性栈
         vbkt: int = 0                   # 段落公式括号计数
         # 公式组
-        vstk: list[LTChar] = []         # 公式符号组
+        vstk: list[Char] = []           # 公式符号组
         vlstk: list[LTLine] = []        # 公式线条组
         vfix: float = 0                 # 公式纵向偏移
         # 公式组栈
-        var: list[list[LTChar]] = []    # 公式符号组栈
+        var: list[list[Char]] = []      # 公式符号组栈
         varl: list[list[LTLine]] = []   # 公式线条组栈
         varf: list[float] = []          # 公式纵向偏移栈
         vlen: list[float] = []          # 公式宽度栈
         # 全局
         lstk: list[LTLine] = []         # 全局线条栈
-        xt: LTChar = None               # 上一个字符
+        xt: Char = None                 # 上一个字符
         xt_cls: int = -1                # 上一个字符所属段落，保证无论第一个字符属于哪个类别都可以触发新段落
         vmax: float = ltpage.width / 4  # 行内公式最大宽度
-        ops: str = ""                   # 渲染结果
-
-        def vflag(font: str, char: str):    # 匹配公式（和角标）字体
-            if isinstance(font, bytes):     # 不一定能 decode，直接转 str
-                try:
-                    font = font.decode('utf-8')  # 尝试使用 UTF-8 解码
-                except UnicodeDecodeError:
-                    font = ""
-            font = font.split("+")[-1]      # 字体名截断
-            if re.match(r"\(cid:", char):
-                return True
-            # 基于字体名规则的判定
-            if self.vfont:
-                if re.match(self.vfont, font):
-                    return True
-            else:
-                if re.match(                                            # latex 字体
-                    r"(CM[^R]|MS.M|XY|MT|BL|RM|EU|LA|RS|LINE|LCIRCLE|TeX-|rsfs|txsy|wasy|stmary|.*Mono|.*Code|.*Ital|.*Sym|.*Math)",
-                    font,
-                ):
-                    return True
-            # 基于字符集规则的判定
-            if self.vchar:
-                if re.match(self.vchar, char):
-                    return True
-            else:
-                if (
-                    char
-                    and char != " "                                     # 非空格
-                    and (
-                        unicodedata.category(char[0])
-                        in ["Lm", "Mn", "Sk", "Sm", "Zl", "Zp", "Zs"]   # 文字修饰符、数学符号、分隔符号
-                        or ord(char[0]) in range(0x370, 0x400)          # 希腊字母
-                    )
-                ):
-                    return True
-            return False
+
+        ############################################################
+        # 预处理：一次查出所有字符和线条在 layout 中的类别
+        children = list(ltpage)
+        clss: list[int] = [-1] * len(children)
+        marked = [i for i, child in enumerate(children) if isinstance(child, (Char, LTLine))]
+        if marked:
+            layout = self.layout[ltpage.pageid]
+            # ltpage.height 可能是 fig 里面的高度，这里统一用 layout.shape
+            h, w = layout.shape
+            xy = np.array([(children[i].x0, children[i].y0) for i in marked])
+            cx = np.clip(xy[:, 0].astype(int), 0, w - 1)
+            cy = np.clip(xy[:, 1].astype(int), 0, h - 1)
+            for i, cls in zip(marked, layout[cy, cx].tolist()):
+                clss[i] = cls
 
         ############################################################
         # A. 原文档解析
-        for child in ltpage:
-            if isinstance(child, LTChar):
+        for child, cls in zip(children, clss):
+            if isinstance(child, Char):
                 cur_v = False
-                layout = self.layout[ltpage.pageid]
-                # ltpage.height 可能是 fig 里面的高度，这里统一用 layout.shape
-                h, w = layout.shape
-                # 读取当前字符在 layout 中的类别
-                cx, cy = np.clip(int(child.x0), 0, w - 1), np.clip(int(child.y0), 0, h - 1)
-                cls = layout[cy, cx]
                 # 锚定文档中 bullet 的位置
                 if child.get_text() == "•":
                     cls = 0
@@ -240,7 +798,7 @@ class TranslateConverter(PDFConverterEx):
                 if (                                                                                        # 判定当前字符是否属于公式
                     cls == 0                                                                                # 1. 类别为保留区域
                     or (cls == xt_cls and len(sstk[-1].strip()) > 1 and child.size < pstk[-1].size * 0.79)  # 2. 角标字体，有 0.76 的角标和 0.799 的大写，这里用 0.79 取中，同时考虑首字母放大的情况
-                    or vflag(child.fontname, child.get_text())                                              # 3. 公式字体
+                    or self.vflag(child.fontname, child.get_text())                                         # 3. 公式字体
                     or (child.matrix[0] == 0 and child.matrix[3] == 0)                                      # 4. 垂直字体
                 ):
                     cur_v = True
@@ -315,12 +873,6 @@ class TranslateConverter(PDFConverterEx):
             elif isinstance(child, LTFigure):   # 图表
                 pass
             elif isinstance(child, LTLine):     # 线条
-                layout = self.layout[ltpage.pageid]
-                # ltpage.height 可能是 fig 里面的高度，这里统一用 layout.shape
-                h, w = layout.shape
-                # 读取当前线条在 layout 中的类别
-                cx, cy = np.clip(int(child.x0), 0, w - 1), np.clip(int(child.y0), 0, h - 1)
-                cls = layout[cy, cx]
                 if vstk and cls == xt_cls:      # 公式线条
                     vlstk.append(child)
                 else:                           # 全局线条
@@ -339,37 +891,24 @@ class TranslateConverter(PDFConverterEx):
             log.debug(f'< {l:.1f} {v[0].x0:.1f} {v[0].y0:.1f} {v[0].cid} {v[0].fontname} {len(varl[id])} > v{id} = {"".join([ch.get_text() for ch in v])}')
             vlen.append(l)
 
-        ############################################################
-        # B. 段落翻译
-        log.debug("\n==========[SSTACK]==========\n")
+        return ParsedLayout(sstk, pstk, var, varl, varf, vlen, lstk, self.fontmap, self.fontid)
 
-        @retry(wait=wait_fixed(1))
-        def worker(s: str):  # 多线程翻译
-            if not s.strip() or re.match(r"^\{v\d+\}$", s):  # 空白和公式不翻译
-                return s
-            try:
-                new = self.translator.translate(s)
-                return new
-            except BaseException as e:
-                if log.isEnabledFor(logging.DEBUG):
-                    log.exception(e)
-                else:
-                    log.exception(e, exc_info=False)
-                raise e
-        with concurrent.futures.ThreadPoolExecutor(
-            max_workers=self.thread
-        ) as executor:
-            news = list(executor.map(worker, sstk))
+    def typeset(self, parsed: ParsedLayout, news: list[str]) -> bytes:
+        sstk, pstk, var, varl, varf, vlen, lstk = (
+            parsed.sstk, parsed.pstk, parsed.var, parsed.varl, parsed.varf, parsed.vlen, parsed.lstk
+        )
+        fontmap, fontid = parsed.fontmap, parsed.fontid
+        log.debug("\n==========[SSTACK]==========\n")
 
         ############################################################
         # C. 新文档排版
-        def raw_string(fcur: str, cstk: str):  # 编码字符串
+        def raw_string(fcur: str, cstk: str) -> bytes:  # 编码字符串
             if fcur == self.noto_name:
-                return "".join(["%04x" % self.noto.has_glyph(ord(c)) for c in cstk])
-            elif isinstance(self.fontmap[fcur], PDFCIDFont):  # 判断编码长度
-                return "".join(["%04x" % ord(c) for c in cstk])
+                return b"".join([b"%04x" % self.noto_metrics.glyph(ord(c)) for c in cstk])
+            elif isinstance(fontmap[fcur], PDFCIDFont):  # 判断编码长度
+                return b"".join([b"%04x" % ord(c) for c in cstk])
             else:
-                return "".join(["%02x" % ord(c) for c in cstk])
+                return b"".join([b"%02x" % ord(c) for c in cstk])
 
         # 根据目标语言获取默认行距
         LANG_LINEHEIGHT_MAP = {
@@ -378,13 +917,7 @@ class TranslateConverter(PDFConverterEx):
         }
         default_line_height = LANG_LINEHEIGHT_MAP.get(self.translator.lang_out.lower(), 1.1) # 小语种默认1.1
         _x, _y = 0, 0
-        ops_list = []
-
-        def gen_op_txt(font, size, x, y, rtxt):
-            return f"/{font} {size:f} Tf 1 0 0 1 {x:f} {y:f} Tm [<{rtxt}>] TJ "
-
-        def gen_op_line(x, y, xlen, ylen, linewidth):
-            return f"ET q 1 0 0 1 {x:f} {y:f} cm [] 0 d 0 J {linewidth:f} w 0 0 m {xlen:f} {ylen:f} l S Q BT "
+        writer = OpsWriter()
 
         for id, new in enumerate(news):
             x: float = pstk[id].x                       # 段落初始横坐标
@@ -399,18 +932,14 @@ class TranslateConverter(PDFConverterEx):
             lidx = 0                                    # 记录换行次数
             tx = x
             fcur_ = fcur
-            ptr = 0
             log.debug(f"< {y} {x} {x0} {x1} {size} {brk} > {sstk[id]} | {new}")
 
             ops_vals: list[dict] = []
 
-            while ptr < len(new):
-                vy_regex = re.match(
-                    r"\{\s*v([\d\s]+)\}", new[ptr:], re.IGNORECASE
-                )  # 匹配 {vn} 公式标记
+            for token in tokenize(new):
+                vy_regex = None if isinstance(token, str) else token  # {vn} 公式标记
                 mod = 0  # 文字修饰符
                 if vy_regex:  # 加载公式
-                    ptr += len(vy_regex.group(0))
                     try:
                         vid = int(vy_regex.group(1).replace(" ", ""))
                         adv = vlen[vid]
@@ -419,20 +948,14 @@ class TranslateConverter(PDFConverterEx):
                     if var[vid][-1].get_text() and unicodedata.category(var[vid][-1].get_text()[0]) in ["Lm", "Mn", "Sk"]:  # 文字修饰符
                         mod = var[vid][-1].width
                 else:  # 加载文字
-                    ch = new[ptr]
-                    fcur_ = None
-                    try:
-                        if fcur_ is None and self.fontmap["tiro"].to_unichr(ord(ch)) == ch:
-                            fcur_ = "tiro"  # 默认拉丁字体
-                    except Exception:
-                        pass
-                    if fcur_ is None:
-                        fcur_ = self.noto_name  # 默认非拉丁字体
-                    if fcur_ == self.noto_name: # FIXME: change to CONST
-                        adv = self.noto.char_lengths(ch, size)[0]
+                    ch = token
+                    width = self.tiro_width(fontmap.get("tiro"), ch)
+                    if width is not None:
+                        fcur_ = "tiro"  # 默认拉丁字体
+                        adv = width * size
                     else:
-                        adv = self.fontmap[fcur_].char_width(ord(ch)) * size
-                    ptr += 1
+                        fcur_ = self.noto_name  # 默认非拉丁字体
+                        adv = self.noto_metrics.advance(ord(ch)) * size
                 if (                                # 输出文字缓冲区
                     fcur_ != fcur                   # 1. 字体更新
                     or vy_regex                     # 2. 插入公式
@@ -460,11 +983,12 @@ class TranslateConverter(PDFConverterEx):
                         vc = chr(vch.cid)
                         ops_vals.append({
                             "type": OpType.TEXT,
-                            "font": self.fontid[vch.font],
+                            "font": fontid[vch.font],
                             "size": vch.size,
                             "x": x + vch.x0 - var[vid][0].x0,
                             "dy": fix + vch.y0 - var[vid][0].y0,
-                            "rtxt": raw_string(self.fontid[vch.font], vc),
+                            "rtxt": raw_string(fontid[vch.font], vc),
+                            "adv": glyph_advance(vch.font, vch.cid),  # 同一公式的字符合并到一个 TJ
                             "lidx": lidx
                         })
                         if log.isEnabledFor(logging.DEBUG):
@@ -515,16 +1039,15 @@ class TranslateConverter(PDFConverterEx):
 
             for vals in ops_vals:
                 if vals["type"] == OpType.TEXT:
-                    ops_list.append(gen_op_txt(vals["font"], vals["size"], vals["x"], vals["dy"] + y - vals["lidx"] * size * line_height, vals["rtxt"]))
+                    writer.text(vals["font"], vals["size"], vals["x"], vals["dy"] + y - vals["lidx"] * size * line_height, vals["rtxt"], vals.get("adv"))
                 elif vals["type"] == OpType.LINE:
-                    ops_list.append(gen_op_line(vals["x"], vals["dy"] + y - vals["lidx"] * size * line_height, vals["xlen"], vals["ylen"], vals["linewidth"]))
+                    writer.line(vals["x"], vals["dy"] + y - vals["lidx"] * size * line_height, vals["xlen"], vals["ylen"], vals["linewidth"])
 
         for l in lstk:  # 排版全局线条
             if l.linewidth < 5:  # hack 有的文档会用粗线条当图片背景
-                ops_list.append(gen_op_line(l.pts[0][0], l.pts[0][1], l.pts[1][0] - l.pts[0][0], l.pts[1][1] - l.pts[0][1], l.linewidth))
+                writer.line(l.pts[0][0], l.pts[0][1], l.pts[1][0] - l.pts[0][0], l.pts[1][1] - l.pts[0][1], l.linewidth)
 
-        ops = f"BT {''.join(ops_list)}ET "
-        return ops
+        return writer.getvalue()
 
 
 class OpType(Enum):
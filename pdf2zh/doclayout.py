@@ -1,5 +1,10 @@
 import abc
+import hashlib
+import logging
+import os
 import os.path
+import threading
+from typing import Optional
 
 import cv2
 import numpy as np
@@ -7,7 +12,6 @@ import ast
 from babeldoc.assets.assets import get_doclayout_onnx_model_path
 
 try:
-    import onnx
     import onnxruntime
 except ImportError as e:
     if "DLL load failed" in str(e):
@@ -21,16 +25,234 @@ from huggingface_hub import hf_hub_download
 
 from pdf2zh.config import ConfigManager
 
+logger = logging.getLogger(__name__)
+
+OPT_LEVELS = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+EXECUTION_MODES = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def session_config(**overrides) -> dict:
+    """
+    Options of the onnxruntime session, read from the config and overridden by
+    the non-empty keyword arguments (e.g. from the command line).
+    """
+    config = {
+        "threads": ConfigManager.get("ONNX_THREADS"),
+        "inter_threads": ConfigManager.get("ONNX_INTER_THREADS"),
+        "execution_mode": ConfigManager.get("ONNX_EXECUTION_MODE"),
+        "opt_level": ConfigManager.get("ONNX_OPT_LEVEL"),
+        "providers": ConfigManager.get("ONNX_PROVIDERS"),
+        "int8": ConfigManager.get("ONNX_INT8"),
+    }
+    config.update({k: v for k, v in overrides.items() if v})
+    for key in ("threads", "inter_threads"):
+        if config[key]:
+            config[key] = int(config[key])
+    if isinstance(config["int8"], str):  # 来自环境变量
+        config["int8"] = config["int8"].lower() in ("1", "true", "yes")
+    if isinstance(config["providers"], str):
+        config["providers"] = [p for p in config["providers"].split(",") if p]
+    return {k: v for k, v in config.items() if v}
+
+
+def optimized_model_path(model_path: str, config: dict) -> str:
+    """Path of the cached model optimized for this model file, options and onnxruntime."""
+    stat = os.stat(model_path)
+    key = repr(
+        (
+            os.path.abspath(model_path),
+            stat.st_size,
+            stat.st_mtime_ns,
+            onnxruntime.__version__,
+            config.get("opt_level"),
+            config.get("providers"),
+        )
+    )
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    cache_folder = os.path.join(os.path.expanduser("~"), ".cache", "pdf2zh", "onnx")
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_folder, f"{name}.{config['opt_level']}.{digest}.onnx")
+
+
+def quantized_model_path(model_path: str) -> str:
+    """Path of the INT8 model, next to the original one if that folder is writable."""
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    folder = os.path.dirname(os.path.abspath(model_path))
+    if not os.access(folder, os.W_OK):
+        folder = os.path.join(os.path.expanduser("~"), ".cache", "pdf2zh", "onnx")
+    return os.path.join(folder, f"{name}.int8.onnx")
+
+
+def quantize_model(model_path: str) -> str:
+    """
+    Dynamically quantize the weights of the model to INT8, the result is cached on
+    disk and regenerated when the original model changes.
+    """
+    int8_path = quantized_model_path(model_path)
+    if os.path.exists(int8_path) and os.path.getmtime(int8_path) >= os.path.getmtime(
+        model_path
+    ):
+        return int8_path
+    try:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError:
+        logger.warning(
+            "onnx is not installed, install pdf2zh[int8] to quantize the layout model."
+        )
+        raise
+
+    logger.info(f"Quantizing {model_path} to {int8_path}")
+    os.makedirs(os.path.dirname(int8_path), exist_ok=True)
+    # 多个进程可能同时生成，先写入临时文件
+    tmp_path = f"{int8_path}.{os.getpid()}.tmp"
+    # ConvInteger 在 CPU 上只支持 uint8 权重
+    quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QUInt8)
+    os.replace(tmp_path, int8_path)
+    return int8_path
+
+
+def layout_cache_enabled() -> bool:
+    """Whether layout results are cached on disk, on unless ``LAYOUT_CACHE`` is off."""
+    value = ConfigManager.get("LAYOUT_CACHE")
+    if isinstance(value, str):  # 来自环境变量
+        return value.lower() not in ("0", "false", "no")
+    return value is None or bool(value)
+
+
+class LayoutCache:
+    """
+    Raw layout detection results persisted on disk, one ``.npy`` file per page image,
+    so that translating the same document again skips the inference. The cache is
+    best effort: read and write errors are logged, and the least recently used
+    entries are removed once the folder grows beyond ``max_size`` bytes.
+    """
+
+    PRUNE_INTERVAL = 64  # 每写入这么多条检查一次目录大小
+
+    def __init__(
+        self,
+        model_path: str,
+        int8: bool = False,
+        folder: str = None,
+        max_size: int = None,
+    ):
+        self.model_path = model_path
+        self.int8 = int8
+        self.folder = folder or os.path.join(
+            os.path.expanduser("~"), ".cache", "pdf2zh", "layout"
+        )
+        if max_size is None:
+            max_size = int(ConfigManager.get("LAYOUT_CACHE_SIZE") or 256) * 2**20
+        self.max_size = max_size
+        self._model_key = None
+        self._puts = 0
+
+    @property
+    def model_key(self) -> str:
+        # 模型文件变化（更新、量化与否）后旧结果自动失效
+        if self._model_key is None:
+            stat = os.stat(self.model_path)
+            key = repr(
+                (
+                    os.path.abspath(self.model_path),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    self.int8,
+                )
+            )
+            self._model_key = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return self._model_key
+
+    def key(self, image: np.ndarray, imgsz: int) -> str:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{self.model_key}:{image.shape}:{imgsz}".encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], f"{key}.npy")
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        path = self._path(key)
+        try:
+            boxes = np.load(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to load cached layout {key}: {e}")
+            return None
+        try:
+            os.utime(path)  # 记录最近使用时间，清理时优先保留
+        except OSError:
+            pass
+        return boxes
+
+    def put(self, key: str, boxes: np.ndarray):
+        path = self._path(key)
+        # 多个线程或进程可能同时写入同一页，先写入临时文件
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                np.save(f, boxes)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to save cached layout {key}: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        if self._puts % self.PRUNE_INTERVAL == 0:
+            self.prune()
+        self._puts += 1
+
+    def prune(self):
+        """Remove the least recently used entries beyond ``max_size``."""
+        entries = []
+        total = 0
+        try:
+            for sub in os.scandir(self.folder):
+                if not sub.is_dir():
+                    continue
+                for entry in os.scandir(sub.path):
+                    if entry.name.endswith(".npy"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total += stat.st_size
+        except OSError as e:
+            logger.warning(f"Failed to scan layout cache {self.folder}: {e}")
+            return
+        if total <= self.max_size:
+            return
+        # 清理到上限的 80%，避免每次写入都要清理
+        for _, size, path in sorted(entries):
+            if total <= self.max_size * 0.8:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
 
 class DocLayoutModel(abc.ABC):
     @staticmethod
-    def load_onnx():
-        model = OnnxModel.from_pretrained()
+    def load_onnx(session_options: dict = None):
+        model = OnnxModel.from_pretrained(session_options)
         return model
 
     @staticmethod
-    def load_available():
-        return DocLayoutModel.load_onnx()
+    def load_available(session_options: dict = None):
+        return DocLayoutModel.load_onnx(session_options)
 
     @property
     @abc.abstractmethod
@@ -50,6 +272,21 @@ class DocLayoutModel(abc.ABC):
         """
         pass
 
+    def predict_batch(self, images, imgsz=1024, **kwargs) -> list:
+        """
+        Predict the layouts of several document pages.
+
+        Args:
+            images: The images of the document pages.
+            imgsz: Resize size for all images, or a list with one size per image.
+            **kwargs: Additional arguments.
+        """
+        if isinstance(imgsz, int):
+            imgsz = [imgsz] * len(images)
+        return [
+            self.predict(im, imgsz=sz, **kwargs)[0] for im, sz in zip(images, imgsz)
+        ]
+
 
 class YoloResult:
     """Helper class to store detection results from ONNX model."""
@@ -70,20 +307,78 @@ class YoloBox:
 
 
 class OnnxModel(DocLayoutModel):
-    def __init__(self, model_path: str):
+    def __init__(self, model_path: str, session_options: dict = None):
         self.model_path = model_path
-
-        model = onnx.load(model_path)
-        metadata = {d.key: d.value for d in model.metadata_props}
+        if session_options is None:
+            session_options = session_config()
+        self.session_options = session_options
+
+        source_path = model_path
+        if session_options.get("int8"):
+            source_path = quantize_model(model_path)
+        # 直接从文件创建 session，元数据也从 session 读取，避免在内存中再解析一遍模型
+        self.model = self.create_session(source_path)
+        metadata = self.model.get_modelmeta().custom_metadata_map
         self._stride = ast.literal_eval(metadata["stride"])
         self._names = ast.literal_eval(metadata["names"])
-
-        self.model = onnxruntime.InferenceSession(model.SerializeToString())
+        # 导出时固定了 batch 维度的模型只能逐张推理
+        self.static_batch = self.model.get_inputs()[0].shape[0] == 1
+        self.layout_cache = None
+        if layout_cache_enabled():
+            self.layout_cache = LayoutCache(
+                model_path, bool(session_options.get("int8"))
+            )
+
+    def __reduce__(self):
+        # InferenceSession 不能序列化，子进程中按路径重新加载
+        return (self.__class__, (self.model_path, self.session_options))
+
+    def create_session(self, source_path: str) -> onnxruntime.InferenceSession:
+        config = self.session_options
+        options = onnxruntime.SessionOptions()
+        if "threads" in config:
+            options.intra_op_num_threads = config["threads"]
+        if "inter_threads" in config:
+            options.inter_op_num_threads = config["inter_threads"]
+        if "execution_mode" in config:
+            options.execution_mode = EXECUTION_MODES[config["execution_mode"]]
+        providers = None
+        if "providers" in config:
+            available = onnxruntime.get_available_providers()
+            providers = [p for p in config["providers"] if p in available]
+            for p in set(config["providers"]) - set(providers):
+                logger.warning(f"onnxruntime execution provider {p} is not available")
+        if "opt_level" not in config:
+            return onnxruntime.InferenceSession(
+                source_path, options, providers=providers
+            )
+
+        # 优化后的模型缓存到磁盘，之后直接加载，跳过图优化
+        cache_path = optimized_model_path(source_path, config)
+        if os.path.exists(cache_path):
+            options.graph_optimization_level = OPT_LEVELS["disable"]
+            try:
+                return onnxruntime.InferenceSession(
+                    cache_path, options, providers=providers
+                )
+            except Exception as e:
+                logger.warning(f"Failed to load optimized model {cache_path}: {e}")
+        options.graph_optimization_level = OPT_LEVELS[config["opt_level"]]
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        # 多个进程可能同时生成，先写入临时文件
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        options.optimized_model_filepath = tmp_path
+        session = onnxruntime.InferenceSession(
+            source_path, options, providers=providers
+        )
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, cache_path)
+        return session
 
     @staticmethod
-    def from_pretrained():
+    def from_pretrained(session_options: dict = None):
         pth = get_doclayout_onnx_model_path()
-        return OnnxModel(pth)
+        return OnnxModel(pth, session_options)
 
     @property
     def stride(self):
@@ -111,10 +406,11 @@ class OnnxModel(DocLayoutModel):
         r = min(new_h / h, new_w / w)
         resized_h, resized_w = int(round(h * r)), int(round(w * r))
 
-        # Resize image
-        image = cv2.resize(
-            image, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR
-        )
+        # Resize image, pages rendered at the input size are used as is
+        if (resized_h, resized_w) != (h, w):
+            image = cv2.resize(
+                image, (resized_w, resized_h), interpolation=cv2.INTER_LINEAR
+            )
 
         # Calculate padding size and align to stride multiple
         pad_w = (new_w - resized_w) % self.stride
@@ -156,23 +452,69 @@ class OnnxModel(DocLayoutModel):
         return boxes
 
     def predict(self, image, imgsz=1024, **kwargs):
-        # Preprocess input image
-        orig_h, orig_w = image.shape[:2]
-        pix = self.resize_and_pad_image(image, new_shape=imgsz)
-        pix = np.transpose(pix, (2, 0, 1))  # CHW
-        pix = np.expand_dims(pix, axis=0)  # BCHW
-        pix = pix.astype(np.float32) / 255.0  # Normalize to [0, 1]
-        new_h, new_w = pix.shape[2:]
+        return self.predict_batch([image], imgsz=imgsz, **kwargs)
+
+    def predict_batch(self, images, imgsz=1024, **kwargs):
+        if isinstance(imgsz, int):
+            imgsz = [imgsz] * len(images)
+        preds = [None] * len(images)
+        keys = [None] * len(images)
+        if self.layout_cache is not None:
+            try:
+                keys = [self.layout_cache.key(im, sz) for im, sz in zip(images, imgsz)]
+            except OSError as e:  # 缓存只是加速，出错时直接推理
+                logger.warning(f"Layout cache unavailable: {e}")
+                keys = [None] * len(images)
+            preds = [
+                None if key is None else self.layout_cache.get(key) for key in keys
+            ]
+        missing = [i for i, pred in enumerate(preds) if pred is None]
+        if missing:
+            inferred = self.infer_batch(
+                [images[i] for i in missing], [imgsz[i] for i in missing]
+            )
+            for i, pred in zip(missing, inferred):
+                preds[i] = pred
+                if keys[i] is not None:
+                    self.layout_cache.put(keys[i], pred)
+        return [YoloResult(boxes=pred, names=self._names) for pred in preds]
+
+    def infer_batch(self, images, imgsz: list[int]) -> list[np.ndarray]:
+        """Run the model, return the raw ``(x0, y0, x1, y1, conf, cls)`` boxes per image."""
+        # Preprocess input images
+        pixs = [
+            self.resize_and_pad_image(image, new_shape=sz)
+            for image, sz in zip(images, imgsz)
+        ]
+        # Letterbox to a common shape, padding only at the bottom and right so that
+        # the boxes of each image can be scaled back with its own shape
+        batch_h = max(pix.shape[0] for pix in pixs)
+        batch_w = max(pix.shape[1] for pix in pixs)
+        batch = np.full((len(pixs), 3, batch_h, batch_w), 114 / 255.0, dtype=np.float32)
+        for i, pix in enumerate(pixs):
+            h, w = pix.shape[:2]
+            batch[i, :, :h, :w] = np.transpose(pix, (2, 0, 1)) / np.float32(255.0)
 
         # Run inference
-        preds = self.model.run(None, {"images": pix})[0]
+        if self.static_batch and len(pixs) > 1:
+            preds = np.concatenate(
+                [
+                    self.model.run(None, {"images": batch[i : i + 1]})[0]
+                    for i in range(len(pixs))
+                ]
+            )
+        else:
+            preds = self.model.run(None, {"images": batch})[0]
 
         # Postprocess predictions
-        preds = preds[preds[..., 4] > 0.25]
-        preds[..., :4] = self.scale_boxes(
-            (new_h, new_w), preds[..., :4], (orig_h, orig_w)
-        )
-        return [YoloResult(boxes=preds, names=self._names)]
+        results = []
+        for image, pix, pred in zip(images, pixs, preds):
+            pred = pred[pred[..., 4] > 0.25]
+            pred[..., :4] = self.scale_boxes(
+                pix.shape[:2], pred[..., :4], image.shape[:2]
+            )
+            results.append(pred)
+        return results
 
 
 class ModelInstance:
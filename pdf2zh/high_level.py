@@ -1,11 +1,16 @@
 """Functions that can be used for the most common use-cases for pdf2zh.six"""
 
 import asyncio
+import collections
+import concurrent.futures
 import io
+import multiprocessing
 import os
+import queue
 import re
 import sys
 import tempfile
+import threading
 import logging
 from asyncio import CancelledError
 from pathlib import Path
@@ -20,17 +25,24 @@ from pdfminer.pdfexceptions import PDFValueError
 from pdfminer.pdfinterp import PDFResourceManager
 from pdfminer.pdfpage import PDFPage
 from pdfminer.pdfparser import PDFParser
-from pymupdf import Document, Font
+from pymupdf import Document, Font, Matrix
 
 from pdf2zh.converter import TranslateConverter
 from pdf2zh.doclayout import OnnxModel
-from pdf2zh.pdfinterp import PDFPageInterpreterEx
+from pdf2zh.pdfinterp import PDFPageInterpreterEx, PendingPatch
 
 from pdf2zh.config import ConfigManager
 from babeldoc.assets.assets import get_font_and_metadata
 
 NOTO_NAME = "noto"
 
+LAYOUT_QUEUE_SIZE = 4  # 版面分析最多领先解析的页数
+LAYOUT_BATCH_SIZE = 8  # 每次版面分析推理的页数
+MAX_PENDING_PAGES = 16  # 已解析但尚未排版的最大页数
+
+# pymupdf 不是线程安全的，版面分析线程渲染页面和解析线程修改文档需要互斥
+_fitz_lock = threading.Lock()
+
 logger = logging.getLogger(__name__)
 
 noto_list = [
@@ -67,6 +79,98 @@ def check_files(files: List[str]) -> List[str]:
     return missing_files
 
 
+def check_page_workers(page_workers: int, two_pass: bool) -> None:
+    # 子进程各自翻译单独的页面，无法等全文解析完成后再统一翻译
+    if page_workers > 1 and two_pass:
+        raise PDFValueError("two_pass cannot be used with page_workers.")
+
+
+def pixmap_image(pix) -> np.ndarray:
+    return np.frombuffer(pix.samples, np.uint8).reshape(pix.height, pix.width, 3)[
+        :, :, ::-1
+    ]
+
+
+def render_page(page, layout_dpi: int = 0) -> tuple[Any, tuple[int, int]]:
+    """
+    Render a page for layout detection, return the pixmap and the size of the layout
+    mask, i.e. the page at 72 dpi. With ``layout_dpi`` the page is rendered at about
+    that resolution, its height rounded to a multiple of the model stride.
+    """
+    if not layout_dpi:
+        pix = page.get_pixmap()
+        return pix, (pix.height, pix.width)
+    height = max(round(page.rect.height * layout_dpi / 72 / 32), 1) * 32
+    zoom = height / page.rect.height
+    # 直接渲染成模型的输入尺寸，推理前不需要再缩放；版面分析用不到透明通道和注释
+    pix = page.get_pixmap(matrix=Matrix(zoom, zoom), alpha=False, annots=False)
+    irect = page.rect.irect
+    return pix, (irect.height, irect.width)
+
+
+def render_layout(pix, model: OnnxModel, size: tuple[int, int] = None) -> np.ndarray:
+    """
+    Run layout detection on a rendered page and rasterize it into a class mask of
+    ``size``, by default the size of the pixmap.
+    """
+    return render_layouts([pixmap_image(pix)], model, [size])[0]
+
+
+def render_layouts(
+    images: list[np.ndarray], model: OnnxModel, sizes: list = None
+) -> list[np.ndarray]:
+    """
+    Batched ``render_layout`` on images converted with ``pixmap_image``: one inference
+    call for several pages. The images no longer reference pymupdf objects, so this
+    can run outside ``_fitz_lock``.
+    """
+    page_layouts = model.predict_batch(
+        images, imgsz=[int(image.shape[0] / 32) * 32 for image in images]
+    )
+    sizes = [
+        size or image.shape[:2]
+        for image, size in zip(images, sizes or [None] * len(images))
+    ]
+    return [
+        layout_mask(page_layout, h, w, image.shape[0] / h, image.shape[1] / w)
+        for image, page_layout, (h, w) in zip(images, page_layouts, sizes)
+    ]
+
+
+def layout_mask(
+    page_layout, height: int, width: int, scale_y: float = 1.0, scale_x: float = 1.0
+) -> np.ndarray:
+    """Rasterize the boxes, detected on an image ``scale_x``/``scale_y`` times the page size."""
+    # kdtree 是不可能 kdtree 的，不如直接渲染成图片，用空间换时间
+    # 类别编号是 0、1 和框的序号 +2，用最小的整数类型存放
+    dtype = np.uint8 if len(page_layout.boxes) + 2 <= 0xFF else np.uint16
+    box = np.ones((height, width), dtype=dtype)
+    h, w = box.shape
+    scale = np.array([scale_x, scale_y, scale_x, scale_y])
+    vcls = ["abandon", "figure", "table", "isolate_formula", "formula_caption"]
+    for i, d in enumerate(page_layout.boxes):
+        if page_layout.names[int(d.cls)] not in vcls:
+            x0, y0, x1, y1 = d.xyxy.squeeze() / scale
+            x0, y0, x1, y1 = (
+                np.clip(int(x0 - 1), 0, w - 1),
+                np.clip(int(h - y1 - 1), 0, h - 1),
+                np.clip(int(x1 + 1), 0, w - 1),
+                np.clip(int(h - y0 + 1), 0, h - 1),
+            )
+            box[y0:y1, x0:x1] = i + 2
+    for i, d in enumerate(page_layout.boxes):
+        if page_layout.names[int(d.cls)] in vcls:
+            x0, y0, x1, y1 = d.xyxy.squeeze() / scale
+            x0, y0, x1, y1 = (
+                np.clip(int(x0 - 1), 0, w - 1),
+                np.clip(int(h - y1 - 1), 0, h - 1),
+                np.clip(int(x1 + 1), 0, w - 1),
+                np.clip(int(h - y0 + 1), 0, h - 1),
+            )
+            box[y0:y1, x0:x1] = 0
+    return box
+
+
 def translate_patch(
     inf: BinaryIO,
     pages: Optional[list[int]] = None,
@@ -85,8 +189,38 @@ def translate_patch(
     envs: Dict = None,
     prompt: Template = None,
     ignore_cache: bool = False,
+    page_workers: int = 0,
+    font_path: str = "",
+    two_pass: bool = False,
+    concurrency: int = 0,
+    layout_dpi: int = 0,
     **kwarg: Any,
 ) -> None:
+    check_page_workers(page_workers, two_pass)
+    if page_workers > 1:
+        return translate_patch_parallel(
+            inf,
+            pages,
+            vfont,
+            vchar,
+            thread,
+            doc_zh,
+            lang_in,
+            lang_out,
+            service,
+            noto_name,
+            font_path,
+            callback,
+            cancellation_event,
+            model,
+            envs,
+            prompt,
+            ignore_cache,
+            page_workers,
+            concurrency,
+            layout_dpi,
+        )
+
     rsrcmgr = PDFResourceManager()
     layout = {}
     device = TranslateConverter(
@@ -103,6 +237,10 @@ def translate_patch(
         envs,
         prompt,
         ignore_cache,
+        deferred=True,
+        two_pass=two_pass,
+        concurrency=concurrency,
+        font_path=font_path,
     )
 
     assert device is not None
@@ -113,56 +251,277 @@ def translate_patch(
     else:
         total_pages = doc_zh.page_count
 
+    # 三级流水线：版面分析线程 -> 解析（当前线程）-> 翻译线程池，翻译完成的页面按顺序排版
+    layouts = queue.Queue(maxsize=LAYOUT_QUEUE_SIZE)
+    stop = threading.Event()
+    producer = threading.Thread(
+        target=_layout_producer,
+        args=(doc_zh, pages, model, layouts, stop, layout_dpi),
+        daemon=True,
+    )
+    pending = collections.deque()  # 每页尚未排版的 PendingOps
+
     parser = PDFParser(inf)
     doc = PDFDocument(parser)
-    with tqdm.tqdm(total=total_pages) as progress:
-        for pageno, page in enumerate(PDFPage.create_pages(doc)):
-            if cancellation_event and cancellation_event.is_set():
-                raise CancelledError("task cancelled")
-            if pages and (pageno not in pages):
-                continue
-            progress.update()
-            if callback:
-                callback(progress)
-            page.pageno = pageno
-            pix = doc_zh[page.pageno].get_pixmap()
-            image = np.frombuffer(pix.samples, np.uint8).reshape(
-                pix.height, pix.width, 3
-            )[:, :, ::-1]
-            page_layout = model.predict(image, imgsz=int(pix.height / 32) * 32)[0]
-            # kdtree 是不可能 kdtree 的，不如直接渲染成图片，用空间换时间
-            box = np.ones((pix.height, pix.width))
-            h, w = box.shape
-            vcls = ["abandon", "figure", "table", "isolate_formula", "formula_caption"]
-            for i, d in enumerate(page_layout.boxes):
-                if page_layout.names[int(d.cls)] not in vcls:
-                    x0, y0, x1, y1 = d.xyxy.squeeze()
-                    x0, y0, x1, y1 = (
-                        np.clip(int(x0 - 1), 0, w - 1),
-                        np.clip(int(h - y1 - 1), 0, h - 1),
-                        np.clip(int(x1 + 1), 0, w - 1),
-                        np.clip(int(h - y0 + 1), 0, h - 1),
-                    )
-                    box[y0:y1, x0:x1] = i + 2
-            for i, d in enumerate(page_layout.boxes):
-                if page_layout.names[int(d.cls)] in vcls:
-                    x0, y0, x1, y1 = d.xyxy.squeeze()
-                    x0, y0, x1, y1 = (
-                        np.clip(int(x0 - 1), 0, w - 1),
-                        np.clip(int(h - y1 - 1), 0, h - 1),
-                        np.clip(int(x1 + 1), 0, w - 1),
-                        np.clip(int(h - y0 + 1), 0, h - 1),
-                    )
-                    box[y0:y1, x0:x1] = 0
-            layout[page.pageno] = box
-            # 新建一个 xref 存放新指令流
-            page.page_xref = doc_zh.get_new_xref()  # hack 插入页面的新 xref
-            doc_zh.update_object(page.page_xref, "<<>>")
-            doc_zh.update_stream(page.page_xref, b"")
-            doc_zh[page.pageno].set_contents(page.page_xref)
-            interpreter.process_page(page)
-
-    device.close()
+    producer.start()
+    try:
+        with tqdm.tqdm(total=total_pages) as progress:
+            for pageno, page in enumerate(PDFPage.create_pages(doc)):
+                if cancellation_event and cancellation_event.is_set():
+                    raise CancelledError("task cancelled")
+                if pages and (pageno not in pages):
+                    continue
+                progress.update()
+                if callback:
+                    callback(progress)
+                page.pageno = pageno
+                layout[page.pageno] = _next_layout(layouts, page.pageno)
+                with _fitz_lock:
+                    # 新建一个 xref 存放新指令流
+                    page.page_xref = doc_zh.get_new_xref()  # hack 插入页面的新 xref
+                    doc_zh.update_object(page.page_xref, "<<>>")
+                    doc_zh.update_stream(page.page_xref, b"")
+                    doc_zh[page.pageno].set_contents(page.page_xref)
+                interpreter.process_page(page)
+                # 解析完成后不再需要版面，避免整个文档的版面常驻内存
+                del layout[page.pageno]
+                pending.append(device.pending)
+                device.pending = []
+                if two_pass:  # 全文解析完成后才开始翻译
+                    continue
+                # 背压：在途页面过多时阻塞等待最早的页面翻译完成
+                while pending and (
+                    len(pending) > MAX_PENDING_PAGES
+                    or all(ops.done() for ops in pending[0])
+                ):
+                    for ops in pending.popleft():
+                        ops.finish()
+        device.flush()
+        for page_pending in pending:
+            for ops in page_pending:
+                ops.finish()
+    finally:
+        stop.set()
+        device.close()
+
+    for obj_id, patch in list(obj_patch.items()):
+        if isinstance(patch, PendingPatch):
+            try:
+                obj_patch[obj_id] = patch.result()
+            except Exception:
+                if patch.strict:
+                    raise
+                del obj_patch[obj_id]  # 与同步排版一致，form xobject 排版失败时不打补丁
+    return obj_patch
+
+
+def _layout_producer(
+    doc_zh: Document,
+    pages: Optional[list[int]],
+    model: OnnxModel,
+    layouts: queue.Queue,
+    stop: threading.Event,
+    layout_dpi: int = 0,
+) -> None:
+    def put(item):
+        while not stop.is_set():
+            try:
+                layouts.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    try:
+        pagenos = [
+            pageno
+            for pageno in range(doc_zh.page_count)
+            if not pages or pageno in pages
+        ]
+        # 连续的页面合并成一批做版面分析，减少推理调用次数
+        for i in range(0, len(pagenos), LAYOUT_BATCH_SIZE):
+            if stop.is_set():
+                return
+            batch = pagenos[i : i + LAYOUT_BATCH_SIZE]
+            # 解析线程只会修改已经完成版面分析的页面，这里渲染的仍是原始页面
+            # 读取和释放 pixmap 也要持锁，推理只用转换好的 numpy 数组
+            with _fitz_lock:
+                images, sizes = [], []
+                for pageno in batch:
+                    pix, size = render_page(doc_zh[pageno], layout_dpi)
+                    images.append(pixmap_image(pix))
+                    sizes.append(size)
+                del pix
+            for pageno, box in zip(batch, render_layouts(images, model, sizes)):
+                put((pageno, box))
+        put((None, None))  # 所有页面的版面都已放入队列
+    except Exception as e:
+        put((None, e))
+
+
+def _next_layout(layouts: queue.Queue, pageno: int) -> np.ndarray:
+    layout_pageno, box = layouts.get()
+    if layout_pageno is None:
+        if box is None:  # 页面树损坏时 pdfminer 可能比 pymupdf 解析出更多页面
+            raise IndexError(
+                f"page {pageno} is not in the document rendered for layout"
+            )
+        raise box
+    assert layout_pageno == pageno, f"layout of page {layout_pageno} != {pageno}"
+    return box
+
+
+# 页面并行：每个子进程各自持有 pdfminer 解析器、渲染用文档和转换器
+_page_worker: Dict[str, Any] = {}
+
+
+def _init_page_worker(
+    stream: bytes,
+    vfont: str,
+    vchar: str,
+    thread: int,
+    lang_in: str,
+    lang_out: str,
+    service: str,
+    noto_name: str,
+    font_path: str,
+    model: OnnxModel,
+    envs: Dict,
+    prompt: Template,
+    ignore_cache: bool,
+    concurrency: int,
+    layout_dpi: int,
+) -> None:
+    rsrcmgr = PDFResourceManager()
+    layout = {}
+    device = TranslateConverter(
+        rsrcmgr,
+        vfont,
+        vchar,
+        thread,
+        layout,
+        lang_in,
+        lang_out,
+        service,
+        noto_name,
+        Font(noto_name, font_path),
+        envs,
+        prompt,
+        ignore_cache,
+        concurrency=concurrency,
+        font_path=font_path,
+    )
+    parser = PDFParser(io.BytesIO(stream))
+    _page_worker.update(
+        rsrcmgr=rsrcmgr,
+        device=device,
+        layout=layout,
+        model=model,
+        layout_dpi=layout_dpi,
+        doc=Document(stream=stream),
+        pages=list(PDFPage.create_pages(PDFDocument(parser))),
+    )
+
+
+def _translate_page(pageno: int, page_xref: int) -> dict:
+    state = _page_worker
+    if pageno >= len(state["pages"]):
+        return {}
+    page = state["pages"][pageno]
+    page.pageno = pageno
+    page.page_xref = page_xref
+    pix, size = render_page(state["doc"][pageno], state["layout_dpi"])
+    state["layout"][pageno] = render_layout(pix, state["model"], size)
+    obj_patch = {}
+    interpreter = PDFPageInterpreterEx(state["rsrcmgr"], state["device"], obj_patch)
+    interpreter.process_page(page)
+    del state["layout"][pageno]
+    return obj_patch
+
+
+def translate_patch_parallel(
+    inf: BinaryIO,
+    pages: Optional[list[int]],
+    vfont: str,
+    vchar: str,
+    thread: int,
+    doc_zh: Document,
+    lang_in: str,
+    lang_out: str,
+    service: str,
+    noto_name: str,
+    font_path: str,
+    callback: object,
+    cancellation_event: asyncio.Event,
+    model: OnnxModel,
+    envs: Dict,
+    prompt: Template,
+    ignore_cache: bool,
+    page_workers: int,
+    concurrency: int,
+    layout_dpi: int,
+) -> dict:
+    """Shard pages across worker processes and merge their patches in page order.
+
+    Page xrefs are allocated up front in the same order as the serial path, and
+    the per-page patches are merged by ascending page number, so the result is
+    identical to ``translate_patch`` with ``page_workers=0``.
+    """
+    inf.seek(0)
+    stream = inf.read()
+    page_xrefs = {}
+    for pageno in range(doc_zh.page_count):
+        if pages and (pageno not in pages):
+            continue
+        # 新建一个 xref 存放新指令流
+        page_xrefs[pageno] = doc_zh.get_new_xref()
+        doc_zh.update_object(page_xrefs[pageno], "<<>>")
+        doc_zh.update_stream(page_xrefs[pageno], b"")
+        doc_zh[pageno].set_contents(page_xrefs[pageno])
+
+    results = {}
+    # spawn 而不是 fork：onnxruntime 的线程池在 fork 之后不可用
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=min(page_workers, max(len(page_xrefs), 1)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_page_worker,
+        initargs=(
+            stream,
+            vfont,
+            vchar,
+            thread,
+            lang_in,
+            lang_out,
+            service,
+            noto_name,
+            font_path,
+            model,
+            envs,
+            prompt,
+            ignore_cache,
+            concurrency,
+            layout_dpi,
+        ),
+    ) as executor:
+        futures = {
+            executor.submit(_translate_page, pageno, page_xref): pageno
+            for pageno, page_xref in page_xrefs.items()
+        }
+        with tqdm.tqdm(total=len(futures)) as progress:
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    if cancellation_event and cancellation_event.is_set():
+                        raise CancelledError("task cancelled")
+                    results[futures[future]] = future.result()
+                    progress.update()
+                    if callback:
+                        callback(progress)
+            except BaseException:
+                executor.shutdown(wait=False, cancel_futures=True)
+                raise
+
+    obj_patch = {}
+    for pageno in sorted(results):
+        obj_patch.update(results[pageno])
     return obj_patch
 
 
@@ -182,6 +541,10 @@ def translate_stream(
     prompt: Template = None,
     skip_subset_fonts: bool = False,
     ignore_cache: bool = False,
+    page_workers: int = 0,
+    two_pass: bool = False,
+    concurrency: int = 0,
+    layout_dpi: int = 0,
     **kwarg: Any,
 ):
     font_list = [("tiro", None)]
@@ -235,8 +598,8 @@ def translate_stream(
         # ops_old=doc_en.xref_stream(obj_id)
         # print(obj_id)
         # print(ops_old)
-        # print(ops_new.encode())
-        doc_zh.update_stream(obj_id, ops_new.encode())
+        # print(ops_new)
+        doc_zh.update_stream(obj_id, ops_new)
 
     doc_en.insert_file(doc_zh)
     for id in range(page_count):
@@ -317,10 +680,15 @@ def translate(
     prompt: Template = None,
     skip_subset_fonts: bool = False,
     ignore_cache: bool = False,
+    page_workers: int = 0,
+    two_pass: bool = False,
+    concurrency: int = 0,
+    layout_dpi: int = 0,
     **kwarg: Any,
 ):
     if not files:
         raise PDFValueError("No files to process.")
+    check_page_workers(page_workers, two_pass)
 
     missing_files = check_files(files)
 
@@ -13,7 +13,13 @@ from typing import List, Optional
 
 from pdf2zh import __version__, log
 from pdf2zh.high_level import translate, download_remote_fonts
-from pdf2zh.doclayout import OnnxModel, ModelInstance
+from pdf2zh.doclayout import (
+    EXECUTION_MODES,
+    OPT_LEVELS,
+    OnnxModel,
+    ModelInstance,
+    session_config,
+)
 import os
 
 from pdf2zh.config import ConfigManager
@@ -106,6 +112,23 @@ def create_parser() -> argparse.ArgumentParser:
         default=4,
         help="The number of threads to execute translation.",
     )
+    parse_params.add_argument(
+        "--page-workers",
+        type=int,
+        default=0,
+        help="The number of processes to translate pages in parallel, cannot be used with --two-pass.",
+    )
+    parse_params.add_argument(
+        "--two-pass",
+        action="store_true",
+        help="Parse the whole document before translating its unique paragraphs.",
+    )
+    parse_params.add_argument(
+        "--concurrency",
+        type=int,
+        default=0,
+        help="Send translation requests from an asyncio event loop, with at most this many in flight.",
+    )
     parse_params.add_argument(
         "--interactive",
         "-i",
@@ -151,6 +174,42 @@ def create_parser() -> argparse.ArgumentParser:
         type=str,
         help="custom onnx model path.",
     )
+    parse_params.add_argument(
+        "--onnx-threads",
+        type=int,
+        help="The number of threads onnxruntime uses within an operator.",
+    )
+    parse_params.add_argument(
+        "--onnx-inter-threads",
+        type=int,
+        help="The number of threads onnxruntime uses across operators in parallel mode.",
+    )
+    parse_params.add_argument(
+        "--onnx-execution-mode",
+        choices=list(EXECUTION_MODES),
+        help="Run the operators of the layout model sequentially or in parallel.",
+    )
+    parse_params.add_argument(
+        "--onnx-opt-level",
+        choices=list(OPT_LEVELS),
+        help="Graph optimization level, the optimized model is cached for later runs.",
+    )
+    parse_params.add_argument(
+        "--onnx-providers",
+        type=str,
+        help="Comma separated onnxruntime execution providers.",
+    )
+    parse_params.add_argument(
+        "--layout-dpi",
+        type=int,
+        default=0,
+        help="Render pages at this resolution for layout detection, 72 by default.",
+    )
+    parse_params.add_argument(
+        "--onnx-int8",
+        action="store_true",
+        help="Use an INT8 quantized layout model, generated once and cached next to the model. Generating it requires the int8 extra (pip install pdf2zh[int8]).",
+    )
 
     parse_params.add_argument(
         "--serverport",
@@ -203,7 +262,11 @@ def create_parser() -> argparse.ArgumentParser:
 
 
 def parse_args(args: Optional[List[str]]) -> argparse.Namespace:
-    parsed_args = create_parser().parse_args(args=args)
+    parser = create_parser()
+    parsed_args = parser.parse_args(args=args)
+
+    if parsed_args.two_pass and parsed_args.page_workers > 1:
+        parser.error("--two-pass cannot be used with --page-workers")
 
     if parsed_args.pages:
         pages = []
@@ -266,10 +329,18 @@ def main(args: Optional[List[str]] = None) -> int:
     if parsed_args.debug:
         log.setLevel(logging.DEBUG)
 
+    session_options = session_config(
+        threads=parsed_args.onnx_threads,
+        inter_threads=parsed_args.onnx_inter_threads,
+        execution_mode=parsed_args.onnx_execution_mode,
+        opt_level=parsed_args.onnx_opt_level,
+        providers=parsed_args.onnx_providers,
+        int8=parsed_args.onnx_int8,
+    )
     if parsed_args.onnx:
-        ModelInstance.value = OnnxModel(parsed_args.onnx)
+        ModelInstance.value = OnnxModel(parsed_args.onnx, session_options)
     else:
-        ModelInstance.value = OnnxModel.load_available()
+        ModelInstance.value = OnnxModel.load_available(session_options)
 
     if parsed_args.interactive:
         from pdf2zh.gui import setup_gui
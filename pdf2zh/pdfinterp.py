@@ -48,6 +48,38 @@ def safe_float(o: Any) -> Optional[float]:
         return None
 
 
+def format_args(args) -> str:
+    return " ".join(
+        [f"{x:f}" if isinstance(x, float) else str(x).replace("'", "") for x in args]
+    )
+
+
+class PendingPatch:
+    """An obj_patch entry whose new ops are still waiting to be typeset.
+
+    ``ops`` is the ``PendingOps`` returned by a deferred converter. Patches of
+    form xobjects are not ``strict``: like the synchronous path, a failure while
+    typesetting them drops the patch instead of failing the page.
+    """
+
+    def __init__(self, prefix: str, ops, strict: bool = True) -> None:
+        self.prefix = prefix
+        self.ops = ops
+        self.strict = strict
+
+    def done(self) -> bool:
+        return self.ops.done()
+
+    def result(self) -> bytes:
+        return self.prefix.encode() + self.ops.result()
+
+
+def make_patch(prefix: str, ops, strict: bool = True):
+    if isinstance(ops, bytes):
+        return prefix.encode() + ops
+    return PendingPatch(prefix, ops, strict)
+
+
 class PDFPageInterpreterEx(PDFPageInterpreter):
     """Processor for the content of a PDF page
 
@@ -238,8 +270,8 @@ class PDFPageInterpreterEx(PDFPageInterpreter):
                     pos_inv = -np.mat(ctm[4:]) * ctm_inv
                 a, b, c, d = ctm_inv.reshape(4).tolist()
                 e, f = pos_inv.tolist()[0]
-                self.obj_patch[self.xobjmap[xobjid].objid] = (
-                    f"q {ops_base}Q {a} {b} {c} {d} {e} {f} cm {ops_new}"
+                self.obj_patch[self.xobjmap[xobjid].objid] = make_patch(
+                    f"q {ops_base}Q {a} {b} {c} {d} {e} {f} cm ", ops_new, strict=False
                 )
             except Exception:
                 pass
@@ -271,11 +303,12 @@ class PDFPageInterpreterEx(PDFPageInterpreter):
         self.device.fontmap = self.fontmap
         ops_new = self.device.end_page(page)
         # 上面渲染的时候会根据 cropbox 减掉页面偏移得到真实坐标，这里输出的时候需要用 cm 把页面偏移加回来
-        self.obj_patch[page.page_xref] = (
-            f"q {ops_base}Q 1 0 0 1 {x0} {y0} cm {ops_new}"  # ops_base 里可能有图，需要让 ops_new 里的文字覆盖在上面，使用 q/Q 重置位置矩阵
+        # ops_base 里可能有图，需要让 ops_new 里的文字覆盖在上面，使用 q/Q 重置位置矩阵
+        self.obj_patch[page.page_xref] = make_patch(
+            f"q {ops_base}Q 1 0 0 1 {x0} {y0} cm ", ops_new
         )
         for obj in page.contents:
-            self.obj_patch[obj.objid] = ""
+            self.obj_patch[obj.objid] = b""
 
     def render_contents(
         self,
@@ -298,69 +331,77 @@ class PDFPageInterpreterEx(PDFPageInterpreter):
         self.init_state(ctm)
         return self.execute(list_value(streams))
 
+    @classmethod
+    def operators(cls) -> Dict[PSKeyword, tuple]:
+        # 每个类各自的操作符分派表，首次遇到某个操作符时填入
+        table = cls.__dict__.get("_operators")
+        if table is None:
+            table = {}
+            cls._operators = table
+        return table
+
+    @classmethod
+    def operator(cls, keyword: PSKeyword) -> tuple:
+        """Name, handler, arity and whether the operator is copied to the output."""
+        table = cls.operators()
+        entry = table.get(keyword)
+        if entry is None:
+            name = keyword_name(keyword)
+            method = "do_%s" % name.replace("*", "_a").replace('"', "_w").replace(
+                "'",
+                "_q",
+            )
+            func = getattr(cls, method, None)
+            nargs, copy = 0, False
+            if func is not None:
+                nargs = func.__code__.co_argcount - 1
+                if nargs:
+                    # 过滤 T 系列文字指令，因为 EI 的参数是 obj 所以也需要过滤（只在少数文档中画横线时使用），过滤 marked 系列指令
+                    copy = not (
+                        name[0] == "T"
+                        or name in ['"', "'", "EI", "MP", "DP", "BMC", "BDC"]
+                    )
+                else:
+                    copy = not (name[0] == "T" or name in ["BI", "ID", "EMC"])
+            entry = table[keyword] = (name, func, nargs, copy)
+        return entry
+
     def execute(self, streams: Sequence[object]) -> None:
         # 重载返回指令流
-        ops = ""
+        ops = []
         try:
             parser = PDFContentParser(streams)
         except PSEOF:
             # empty page
             return
+        table = self.operators()
         while True:
             try:
                 (_, obj) = parser.nextobject()
             except PSEOF:
                 break
             if isinstance(obj, PSKeyword):
-                name = keyword_name(obj)
-                method = "do_%s" % name.replace("*", "_a").replace('"', "_w").replace(
-                    "'",
-                    "_q",
-                )
-                if hasattr(self, method):
-                    func = getattr(self, method)
-                    nargs = func.__code__.co_argcount - 1
+                entry = table.get(obj)
+                if entry is None:
+                    entry = self.operator(obj)
+                name, func, nargs, copy = entry
+                if func is not None:
                     if nargs:
                         args = self.pop(nargs)
                         # log.debug("exec: %s %r", name, args)
                         if len(args) == nargs:
-                            func(*args)
-                            if not (
-                                name[0] == "T"
-                                or name in ['"', "'", "EI", "MP", "DP", "BMC", "BDC"]
-                            ):  # 过滤 T 系列文字指令，因为 EI 的参数是 obj 所以也需要过滤（只在少数文档中画横线时使用），过滤 marked 系列指令
-                                p = " ".join(
-                                    [
-                                        (
-                                            f"{x:f}"
-                                            if isinstance(x, float)
-                                            else str(x).replace("'", "")
-                                        )
-                                        for x in args
-                                    ]
-                                )
-                                ops += f"{p} {name} "
+                            func(self, *args)
+                            if copy:
+                                ops.append(f"{format_args(args)} {name} ")
                     else:
                         # log.debug("exec: %s", name)
-                        targs = func()
-                        if targs is None:
-                            targs = []
-                        if not (name[0] == "T" or name in ["BI", "ID", "EMC"]):
-                            p = " ".join(
-                                [
-                                    (
-                                        f"{x:f}"
-                                        if isinstance(x, float)
-                                        else str(x).replace("'", "")
-                                    )
-                                    for x in targs
-                                ]
-                            )
-                            ops += f"{p} {name} "
+                        targs = func(self)
+                        if copy:
+                            ops.append(f"{format_args(targs or [])} {name} ")
                 elif settings.STRICT:
                     error_msg = "Unknown operator: %r" % name
                     raise PDFInterpreterError(error_msg)
             else:
                 self.push(obj)
         # print('REV DATA',ops)
-        return ops
+        return "".join(ops)
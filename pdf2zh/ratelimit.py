@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+from pdf2zh.config import ConfigManager
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a request, about four characters per token."""
+    return len(text) // 4 + 1
+
+
+def is_rate_limited(e: BaseException) -> bool:
+    """Whether the exception means the service rejected the request for its rate."""
+    for obj in (e, getattr(e, "response", None)):
+        for attr in ("status_code", "http_status_code", "status"):
+            if getattr(obj, attr, None) == 429:
+                return True
+    code = getattr(e, "code", None)
+    return isinstance(code, str) and "LimitExceeded" in code  # tencentcloud
+
+
+def retry_after(e: BaseException) -> Optional[float]:
+    """The delay requested by the service in the Retry-After header, if any."""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    try:
+        return float(headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Requests/sec and tokens/min limits plus AIMD adaptive concurrency for one service.
+
+    Both limits are token buckets implemented as reservations (GCRA): every request
+    books its slot under the lock and then sleeps until it is due, so the limiter works
+    the same from threads and from an event loop. The concurrency limit grows by one
+    per window of successful requests and halves when the service answers with 429.
+    """
+
+    def __init__(
+        self,
+        rps: float = 0,
+        tpm: float = 0,
+        concurrency: int = 0,
+        min_concurrency: int = 1,
+        cooldown: float = 1.0,
+    ):
+        self.rps = rps
+        self.tpm = tpm
+        self.max_concurrency = concurrency or math.inf
+        self.min_concurrency = min_concurrency
+        self.cooldown = cooldown  # 两次减半之间的最小间隔，避免同一波 429 连续减半
+        self.limit = float(self.max_concurrency)
+        self.inflight = 0
+        self.cond = threading.Condition()
+        self.waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self.request_tat = 0.0  # 下一个请求的理论到达时间
+        self.token_tat = 0.0
+        self.paused_until = 0.0
+        self.last_decrease = -math.inf
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Book a request of ``tokens`` tokens, return how long to wait before sending it."""
+        with self.cond:
+            now = time.monotonic()
+            due = max(now, self.paused_until)
+            if self.rps > 0:
+                interval = 1 / self.rps
+                burst = max(self.rps, 1) * interval
+                due = max(due, self.request_tat + interval - burst)
+            if self.tpm > 0:
+                cost = tokens * 60 / self.tpm
+                due = max(due, self.token_tat + cost - 60)
+            if self.rps > 0:
+                self.request_tat = max(self.request_tat, due) + 1 / self.rps
+            if self.tpm > 0:
+                self.token_tat = max(self.token_tat, due) + tokens * 60 / self.tpm
+            return due - now
+
+    def acquire(self, tokens: int = 0) -> None:
+        with self.cond:
+            while self.inflight >= self.limit:
+                self.cond.wait()
+            self.inflight += 1
+        time.sleep(self.reserve(tokens))
+
+    async def aacquire(self, tokens: int = 0) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self.cond:
+                if self.inflight < self.limit:
+                    self.inflight += 1
+                    break
+                waiter = loop.create_future()
+                self.waiters.append((loop, waiter))
+            await waiter
+        await asyncio.sleep(self.reserve(tokens))
+
+    def release(self, throttled: bool = False) -> None:
+        with self.cond:
+            self.inflight -= 1
+            if not throttled and self.limit < self.max_concurrency:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.cond.notify_all()
+            waiters, self.waiters = self.waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def throttle(self, delay: Optional[float] = None) -> None:
+        """Back off after a 429: halve the concurrency and pause new requests."""
+        with self.cond:
+            self._decrease()
+            self.paused_until = max(
+                self.paused_until, time.monotonic() + (delay or self.cooldown)
+            )
+
+    def _decrease(self) -> None:
+        now = time.monotonic()
+        if now - self.last_decrease < self.cooldown:
+            return
+        self.last_decrease = now
+        limit = min(self.limit, max(self.inflight, self.min_concurrency))
+        self.limit = max(self.min_concurrency, limit / 2)
+        logger.warning(f"Rate limited, concurrency reduced to {int(self.limit)}")
+
+    @contextmanager
+    def request(self, tokens: int = 0):
+        self.acquire(tokens)
+        try:
+            yield
+        except BaseException as e:
+            self._failed(e)
+            raise
+        self.release()
+
+    @asynccontextmanager
+    async def arequest(self, tokens: int = 0):
+        await self.aacquire(tokens)
+        try:
+            yield
+        except BaseException as e:
+            self._failed(e)
+            raise
+        self.release()
+
+    def _failed(self, e: BaseException) -> None:
+        if is_rate_limited(e):
+            self.throttle(retry_after(e))
+            self.release(throttled=True)
+        else:
+            self.release()
+
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(service: str) -> RateLimiter:
+    """
+    The limiter shared by every translator of ``service`` in this process.
+    Limits are read from the ``RATE_LIMIT`` config, e.g.
+    ``{"openai": {"rps": 5, "tpm": 90000, "concurrency": 16}}``.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(service)
+        if limiter is None:
+            config = ConfigManager.get("RATE_LIMIT") or {}
+            if isinstance(config, str):  # 来自环境变量
+                config = json.loads(config)
+            limiter = _limiters[service] = RateLimiter(**config.get(service, {}))
+        return limiter
@@ -1,3 +1,4 @@
+import asyncio
 import html
 import json
 import logging
@@ -8,6 +9,7 @@ from copy import copy
 from string import Template
 from typing import cast
 import deepl
+import httpx
 import ollama
 import openai
 import requests
@@ -16,6 +18,8 @@ from azure.ai.translation.text import TextTranslationClient
 from azure.core.credentials import AzureKeyCredential
 from tencentcloud.common import credential
 from tencentcloud.tmt.v20180321.models import (
+    TextTranslateBatchRequest,
+    TextTranslateBatchResponse,
     TextTranslateRequest,
     TextTranslateResponse,
 )
@@ -23,6 +27,7 @@ from tencentcloud.tmt.v20180321.tmt_client import TmtClient
 
 from pdf2zh.cache import TranslationCache
 from pdf2zh.config import ConfigManager
+from pdf2zh.ratelimit import estimate_tokens, get_limiter
 
 
 from tenacity import retry, retry_if_exception_type
@@ -37,11 +42,22 @@ def remove_control_characters(s):
     return "".join(ch for ch in s if unicodedata.category(ch)[0] != "C")
 
 
+def log_rate_limit_retry(retry_state):
+    # 重试前通知共享的限流器，让其它请求一起退避
+    retry_state.args[0].limiter.throttle()
+    logger.warning(
+        f"RateLimitError, retrying in {retry_state.next_action.sleep} seconds... "
+        f"(Attempt {retry_state.attempt_number}/100)"
+    )
+
+
 class BaseTranslator:
     name = "base"
     envs = {}
     lang_map: dict[str, str] = {}
     CustomPrompt = False
+    batch_size: int = 1  # 单次请求最多翻译的段落数，大于 1 表示支持批量翻译
+    batch_chars: int = 0  # 单次请求最多翻译的字符数，0 表示不限制
 
     def __init__(self, lang_in: str, lang_out: str, model: str, ignore_cache: bool):
         lang_in = self.lang_map.get(lang_in.lower(), lang_in)
@@ -50,6 +66,9 @@ class BaseTranslator:
         self.lang_out = lang_out
         self.model = model
         self.ignore_cache = ignore_cache
+        self.aclient = None  # 异步客户端，在事件循环线程中按需创建
+        self.batch_cache = None  # 批量 prompt 译文的缓存，按需创建
+        self.limiter = get_limiter(self.name)  # 同一服务的所有实例共用
 
         self.cache = TranslationCache(
             self.name,
@@ -98,7 +117,8 @@ class BaseTranslator:
             if cache is not None:
                 return cache
 
-        translation = self.do_translate(text)
+        with self.limiter.request(estimate_tokens(text)):
+            translation = self.do_translate(text)
         self.cache.set(text, translation)
         return translation
 
@@ -110,6 +130,214 @@ class BaseTranslator:
         """
         raise NotImplementedError
 
+    def translate_batch(
+        self, texts: list[str], ignore_cache: bool = False
+    ) -> list[str]:
+        """
+        Translate several texts, only the ones missing from the cache are sent to the service.
+        :param texts: texts to translate
+        :return: translated texts, in the same order
+        """
+        results, missing = self.lookup_batch(texts, ignore_cache)
+        if missing:
+            batch = [texts[i] for i in missing]
+            cache = self.get_batch_cache()
+            with self.limiter.request(sum(map(estimate_tokens, batch))):
+                translations = self.do_translate_batch(batch)
+                if len(translations) != len(batch):
+                    logger.warning(
+                        "Batch translation returned %d results for %d texts, translate one by one.",
+                        len(translations),
+                        len(batch),
+                    )
+                    translations = [self.do_translate(text) for text in batch]
+                    cache = self.cache
+            for i, translation in zip(missing, translations):
+                results[i] = translation
+            cache.set_many(zip(batch, translations))
+        return results
+
+    def lookup_batch(
+        self, texts: list[str], ignore_cache: bool = False
+    ) -> tuple[list[str], list[int]]:
+        """
+        Look up texts in the cache with a single query, then in the cache of batched
+        translations if it is a separate one.
+        :return: cached translations (None if missing) and the indices of the missing texts
+        """
+        cached = {}
+        if not (self.ignore_cache or ignore_cache):
+            cached = self.cache.get_many(texts)
+            batch_cache = self.get_batch_cache()
+            rest = [text for text in texts if text not in cached]
+            if batch_cache is not self.cache and rest:
+                cached.update(batch_cache.get_many(rest))
+        results = [cached.get(text) for text in texts]
+        missing = [i for i, result in enumerate(results) if result is None]
+        return results, missing
+
+    def get_batch_cache(self) -> TranslationCache:
+        """
+        Cache of the translations returned by ``do_translate_batch``. They are only
+        cached apart from the ones of ``translate`` if the batch request differs.
+        """
+        return self.cache
+
+    def get_prompt_batch_cache(self) -> TranslationCache:
+        """
+        Cache of the translations answered to ``batch_prompt``, with the batch prompt
+        added to the cache params. The params of ``self.cache`` stay unchanged, so the
+        translations cached one by one are still found.
+        """
+        if self.batch_cache is None:
+            params = dict(self.cache.params, batch_prompt=self.batch_prompt([]))
+            self.batch_cache = TranslationCache(self.name, params)
+        return self.batch_cache
+
+    def do_translate_batch(self, texts: list[str]) -> list[str]:
+        """
+        Actual translate several texts in one request, override this method
+        if the service accepts multiple segments. Falls back to one request per text.
+        :param texts: texts to translate
+        :return: translated texts, in the same order
+        """
+        return [self.do_translate(text) for text in texts]
+
+    async def atranslate(self, text: str, ignore_cache: bool = False) -> str:
+        """
+        Asynchronous version of ``translate``.
+        :param text: text to translate
+        :return: translated text
+        """
+        if not (self.ignore_cache or ignore_cache):
+            cache = self.cache.get(text)
+            if cache is not None:
+                return cache
+
+        async with self.limiter.arequest(estimate_tokens(text)):
+            translation = await self.ado_translate(text)
+        self.cache.set(text, translation)
+        return translation
+
+    async def ado_translate(self, text: str) -> str:
+        """
+        Actual translate text asynchronously, override this method with a native
+        async client. Falls back to running ``do_translate`` in a thread.
+        :param text: text to translate
+        :return: translated text
+        """
+        return await asyncio.to_thread(self.do_translate, text)
+
+    async def atranslate_batch(
+        self, texts: list[str], ignore_cache: bool = False
+    ) -> list[str]:
+        """
+        Asynchronous version of ``translate_batch``.
+        """
+        results, missing = self.lookup_batch(texts, ignore_cache)
+        if missing:
+            batch = [texts[i] for i in missing]
+            cache = self.get_batch_cache()
+            async with self.limiter.arequest(sum(map(estimate_tokens, batch))):
+                translations = await self.ado_translate_batch(batch)
+                if len(translations) != len(batch):
+                    logger.warning(
+                        "Batch translation returned %d results for %d texts, translate one by one.",
+                        len(translations),
+                        len(batch),
+                    )
+                    translations = list(
+                        await asyncio.gather(*(self.ado_translate(t) for t in batch))
+                    )
+                    cache = self.cache
+            for i, translation in zip(missing, translations):
+                results[i] = translation
+            cache.set_many(zip(batch, translations))
+        return results
+
+    async def ado_translate_batch(self, texts: list[str]) -> list[str]:
+        """
+        Asynchronous version of ``do_translate_batch``. Falls back to concurrent
+        ``ado_translate`` calls if the service has no native async batch API.
+        """
+        if type(self).do_translate_batch is not BaseTranslator.do_translate_batch:
+            return await asyncio.to_thread(self.do_translate_batch, texts)
+        return list(await asyncio.gather(*(self.ado_translate(t) for t in texts)))
+
+    def get_aclient(self):
+        if self.aclient is None:
+            self.aclient = self.new_aclient()
+        return self.aclient
+
+    def new_aclient(self):
+        """
+        Create the client shared by all asynchronous requests, override this method
+        """
+        # 与 requests 一致不设超时，否则慢响应会在 worker 中无限重试
+        return httpx.AsyncClient(timeout=None)
+
+    async def aclose(self):
+        if self.aclient is not None:
+            close = getattr(self.aclient, "aclose", None) or self.aclient.close
+            await close()
+            self.aclient = None
+
+    def split_batches(self, texts: list[str]) -> list[list[str]]:
+        """
+        Split texts into batches that respect ``batch_size`` and ``batch_chars``.
+        """
+        batches: list[list[str]] = []
+        chars = 0
+        for text in texts:
+            if (
+                not batches
+                or len(batches[-1]) >= self.batch_size
+                or (self.batch_chars and chars + len(text) > self.batch_chars)
+            ):
+                batches.append([])
+                chars = 0
+            batches[-1].append(text)
+            chars += len(text)
+        return batches
+
+    def batch_prompt(self, texts: list[str]) -> list[dict[str, str]]:
+        return [
+            {
+                "role": "user",
+                "content": (
+                    "You are a professional, authentic machine translation engine. "
+                    "\n\n"
+                    f"Translate each markdown source text in the following JSON array to {self.lang_out}. "
+                    "Keep the formula notation {v*} unchanged. "
+                    "Output only a JSON array of strings with exactly one translation per "
+                    "source text, in the same order, without any additional text."
+                    "\n\n"
+                    f"Source Texts: {json.dumps(texts, ensure_ascii=False)}"
+                    "\n\n"
+                    "Translated Texts:"
+                ),
+            },
+        ]
+
+    @staticmethod
+    def parse_batch_response(content: str, count: int) -> list[str] | None:
+        """
+        Parse the JSON array answered to ``batch_prompt``.
+        :return: the translations, or None if the response does not match the request
+        """
+        content = re.sub(r"^```(?:json)?\s*|\s*```$", "", content.strip())
+        try:
+            result = json.loads(content)
+        except ValueError:
+            return None
+        if (
+            not isinstance(result, list)
+            or len(result) != count
+            or not all(isinstance(r, str) for r in result)
+        ):
+            return None
+        return [r.strip() for r in result]
+
     def prompt(
         self, text: str, prompt_template: Template | None = None
     ) -> list[dict[str, str]]:
@@ -183,6 +411,19 @@ class GoogleTranslator(BaseTranslator):
             params={"tl": self.lang_out, "sl": self.lang_in, "q": text},
             headers=self.headers,
         )
+        return self.parse_response(response)
+
+    async def ado_translate(self, text):
+        text = text[:5000]  # google translate max length
+        response = await self.get_aclient().get(
+            self.endpoint,
+            params={"tl": self.lang_out, "sl": self.lang_in, "q": text},
+            headers=self.headers,
+        )
+        return self.parse_response(response)
+
+    @staticmethod
+    def parse_response(response) -> str:
         re_result = re.findall(
             r'(?s)class="(?:t0|result-container)">(.*?)<', response.text
         )
@@ -209,8 +450,19 @@ class BingTranslator(BaseTranslator):
 
     def find_sid(self):
         response = self.session.get(self.endpoint)
+        return self.parse_sid(response)
+
+    async def afind_sid(self):
+        response = await self.get_aclient().get(self.endpoint)
+        return self.parse_sid(response)
+
+    def new_aclient(self):
+        return httpx.AsyncClient(follow_redirects=True, timeout=None)
+
+    @staticmethod
+    def parse_sid(response):
         response.raise_for_status()
-        url = response.url[:-10]
+        url = str(response.url)[:-10]
         ig = re.findall(r"\"ig\":\"(.*?)\"", response.text)[0]
         iid = re.findall(r"data-iid=\"(.*?)\"", response.text)[-1]
         key, token = re.findall(
@@ -235,6 +487,23 @@ class BingTranslator(BaseTranslator):
         response.raise_for_status()
         return response.json()[0]["translations"][0]["text"]
 
+    async def ado_translate(self, text):
+        text = text[:1000]  # bing translate max length
+        url, ig, iid, key, token = await self.afind_sid()
+        response = await self.get_aclient().post(
+            f"{url}ttranslatev3?IG={ig}&IID={iid}",
+            data={
+                "fromLang": self.lang_in,
+                "to": self.lang_out,
+                "text": text,
+                "token": token,
+                "key": key,
+            },
+            headers=self.headers,
+        )
+        response.raise_for_status()
+        return response.json()[0]["translations"][0]["text"]
+
 
 class DeepLTranslator(BaseTranslator):
     # https://github.com/DeepLcom/deepl-python
@@ -243,6 +512,8 @@ class DeepLTranslator(BaseTranslator):
         "DEEPL_AUTH_KEY": None,
     }
     lang_map = {"zh": "zh-Hans"}
+    batch_size = 50  # https://developers.deepl.com/docs/api-reference/translate
+    batch_chars = 100000
 
     def __init__(
         self, lang_in, lang_out, model, envs=None, ignore_cache=False, **kwargs
@@ -258,6 +529,12 @@ class DeepLTranslator(BaseTranslator):
         )
         return response.text
 
+    def do_translate_batch(self, texts):
+        response = self.client.translate_text(
+            texts, target_lang=self.lang_out, source_lang=self.lang_in
+        )
+        return [r.text for r in response]
+
 
 class DeepLXTranslator(BaseTranslator):
     # https://deeplx.owo.network/endpoints/free.html
@@ -291,6 +568,18 @@ class DeepLXTranslator(BaseTranslator):
         response.raise_for_status()
         return response.json()["data"]
 
+    async def ado_translate(self, text):
+        response = await self.get_aclient().post(
+            self.endpoint,
+            json={
+                "source_lang": self.lang_in,
+                "target_lang": self.lang_out,
+                "text": text,
+            },
+        )
+        response.raise_for_status()
+        return response.json()["data"]
+
 
 class OllamaTranslator(BaseTranslator):
     # https://github.com/ollama/ollama-python
@@ -334,6 +623,22 @@ class OllamaTranslator(BaseTranslator):
         content = self._remove_cot_content(response.message.content or "")
         return content.strip()
 
+    async def ado_translate(self, text: str) -> str:
+        # 并发请求共用 options，只增不减，与 do_translate 一致
+        if (max_token := len(text) * 5) > self.options["num_predict"]:
+            self.options["num_predict"] = max_token
+
+        response = await self.get_aclient().chat(
+            model=self.model,
+            messages=self.prompt(text, self.prompt_template),
+            options=self.options,
+        )
+        content = self._remove_cot_content(response.message.content or "")
+        return content.strip()
+
+    def new_aclient(self):
+        return ollama.AsyncClient(host=self.envs["OLLAMA_HOST"])
+
     @staticmethod
     def _remove_cot_content(content: str) -> str:
         """Remove text content with the thought chain from the chat response
@@ -404,6 +709,8 @@ class OpenAITranslator(BaseTranslator):
         "OPENAI_MODEL": "gpt-4o-mini",
     }
     CustomPrompt = True
+    batch_size = 10
+    batch_chars = 8000
 
     def __init__(
         self,
@@ -436,10 +743,7 @@ class OpenAITranslator(BaseTranslator):
         retry=retry_if_exception_type(openai.RateLimitError),
         stop=stop_after_attempt(100),
         wait=wait_exponential(multiplier=1, min=1, max=15),
-        before_sleep=lambda retry_state: logger.warning(
-            f"RateLimitError, retrying in {retry_state.next_action.sleep} seconds... "
-            f"(Attempt {retry_state.attempt_number}/100)"
-        ),
+        before_sleep=log_rate_limit_retry,
     )
     def do_translate(self, text) -> str:
         response = self.client.chat.completions.create(
@@ -454,6 +758,93 @@ class OpenAITranslator(BaseTranslator):
         content = self.think_filter_regex.sub("", content).strip()
         return content
 
+    @retry(
+        retry=retry_if_exception_type(openai.RateLimitError),
+        stop=stop_after_attempt(100),
+        wait=wait_exponential(multiplier=1, min=1, max=15),
+        before_sleep=log_rate_limit_retry,
+    )
+    def do_translate_batch(self, texts) -> list[str]:
+        # 自定义 prompt 无法改写成批量形式，逐条翻译
+        if len(texts) == 1 or self.prompttext:
+            return super().do_translate_batch(texts)
+        response = self.client.chat.completions.create(
+            model=self.model,
+            **self.options,
+            messages=self.batch_prompt(texts),
+        )
+        if response.choices:
+            content = response.choices[0].message.content.strip()
+            content = self.think_filter_regex.sub("", content).strip()
+            result = self.parse_batch_response(content, len(texts))
+            if result is not None:
+                return result
+        logger.warning(
+            "Batch response does not match the request, translate one by one."
+        )
+        return super().do_translate_batch(texts)
+
+    @retry(
+        retry=retry_if_exception_type(openai.RateLimitError),
+        stop=stop_after_attempt(100),
+        wait=wait_exponential(multiplier=1, min=1, max=15),
+        before_sleep=log_rate_limit_retry,
+    )
+    async def ado_translate(self, text) -> str:
+        response = await self.get_aclient().chat.completions.create(
+            model=self.model,
+            **self.options,
+            messages=self.prompt(text, self.prompttext),
+        )
+        if not response.choices:
+            if hasattr(response, "error"):
+                raise ValueError("Error response from Service", response.error)
+        content = response.choices[0].message.content.strip()
+        content = self.think_filter_regex.sub("", content).strip()
+        return content
+
+    @retry(
+        retry=retry_if_exception_type(openai.RateLimitError),
+        stop=stop_after_attempt(100),
+        wait=wait_exponential(multiplier=1, min=1, max=15),
+        before_sleep=log_rate_limit_retry,
+    )
+    async def ado_translate_batch(self, texts) -> list[str]:
+        # 自定义 prompt 无法改写成批量形式，逐条翻译
+        if len(texts) == 1 or self.prompttext:
+            return await super().ado_translate_batch(texts)
+        response = await self.get_aclient().chat.completions.create(
+            model=self.model,
+            **self.options,
+            messages=self.batch_prompt(texts),
+        )
+        if response.choices:
+            content = response.choices[0].message.content.strip()
+            content = self.think_filter_regex.sub("", content).strip()
+            result = self.parse_batch_response(content, len(texts))
+            if result is not None:
+                return result
+        logger.warning(
+            "Batch response does not match the request, translate one by one."
+        )
+        return list(await asyncio.gather(*(self.ado_translate(t) for t in texts)))
+
+    def get_batch_cache(self):
+        # 自定义 prompt 逐条翻译，其余批量 prompt 的译文单独缓存
+        if self.prompttext:
+            return self.cache
+        return self.get_prompt_batch_cache()
+
+    def new_aclient(self):
+        # 与同步客户端使用相同的超时、请求头和重试次数
+        return openai.AsyncOpenAI(
+            base_url=self.client.base_url,
+            api_key=self.client.api_key,
+            timeout=self.client.timeout,
+            max_retries=self.client.max_retries,
+            default_headers=self.client._custom_headers,
+        )
+
     def get_formular_placeholder(self, id: int):
         return "{{v" + str(id) + "}}"
 
@@ -473,6 +864,8 @@ class AzureOpenAITranslator(BaseTranslator):
         "AZURE_OPENAI_API_VERSION": "2024-06-01",  # default api version
     }
     CustomPrompt = True
+    batch_size = 10
+    batch_chars = 8000
 
     def __init__(
         self,
@@ -512,6 +905,31 @@ class AzureOpenAITranslator(BaseTranslator):
         )
         return response.choices[0].message.content.strip()
 
+    def do_translate_batch(self, texts) -> list[str]:
+        # 自定义 prompt 无法改写成批量形式，逐条翻译
+        if len(texts) == 1 or self.prompttext:
+            return super().do_translate_batch(texts)
+        response = self.client.chat.completions.create(
+            model=self.model,
+            **self.options,
+            messages=self.batch_prompt(texts),
+        )
+        result = self.parse_batch_response(
+            response.choices[0].message.content, len(texts)
+        )
+        if result is not None:
+            return result
+        logger.warning(
+            "Batch response does not match the request, translate one by one."
+        )
+        return super().do_translate_batch(texts)
+
+    def get_batch_cache(self):
+        # 自定义 prompt 逐条翻译，其余批量 prompt 的译文单独缓存
+        if self.prompttext:
+            return self.cache
+        return self.get_prompt_batch_cache()
+
 
 class ModelScopeTranslator(OpenAITranslator):
     name = "modelscope"
@@ -558,6 +976,7 @@ class ZhipuTranslator(OpenAITranslator):
         "ZHIPU_MODEL": "glm-4-flash",
     }
     CustomPrompt = True
+    batch_size = 1  # do_translate 需要处理 1301 错误，不走批量请求
 
     def __init__(
         self, lang_in, lang_out, model, envs=None, prompt=None, ignore_cache=False
@@ -578,6 +997,12 @@ class ZhipuTranslator(OpenAITranslator):
         self.prompttext = prompt
         self.add_cache_impact_parameters("prompt", self.prompt("", self.prompttext))
 
+    @retry(
+        retry=retry_if_exception_type(openai.RateLimitError),
+        stop=stop_after_attempt(100),
+        wait=wait_exponential(multiplier=1, min=1, max=15),
+        before_sleep=log_rate_limit_retry,
+    )
     def do_translate(self, text) -> str:
         try:
             response = self.client.chat.completions.create(
@@ -586,10 +1011,26 @@ class ZhipuTranslator(OpenAITranslator):
                 messages=self.prompt(text, self.prompttext),
             )
         except openai.BadRequestError as e:
-            if (
-                json.loads(response.choices[0].message.content.strip())["error"]["code"]
-                == "1301"
-            ):
+            if e.code == "1301":  # 内容安全审核未通过，错误码在响应体的 error 中
+                return "IRREPARABLE TRANSLATION ERROR"
+            raise e
+        return response.choices[0].message.content.strip()
+
+    @retry(
+        retry=retry_if_exception_type(openai.RateLimitError),
+        stop=stop_after_attempt(100),
+        wait=wait_exponential(multiplier=1, min=1, max=15),
+        before_sleep=log_rate_limit_retry,
+    )
+    async def ado_translate(self, text) -> str:
+        try:
+            response = await self.get_aclient().chat.completions.create(
+                model=self.model,
+                **self.options,
+                messages=self.prompt(text, self.prompttext),
+            )
+        except openai.BadRequestError as e:
+            if e.code == "1301":  # 内容安全审核未通过，错误码在响应体的 error 中
                 return "IRREPARABLE TRANSLATION ERROR"
             raise e
         return response.choices[0].message.content.strip()
@@ -661,6 +1102,9 @@ class AzureTranslator(BaseTranslator):
         "AZURE_API_KEY": None,
     }
     lang_map = {"zh": "zh-Hans"}
+    # https://learn.microsoft.com/azure/ai-services/translator/service-limits
+    batch_size = 100
+    batch_chars = 50000
 
     def __init__(
         self, lang_in, lang_out, model, envs=None, ignore_cache=False, **kwargs
@@ -686,6 +1130,14 @@ class AzureTranslator(BaseTranslator):
         translated_text = response[0].translations[0].text
         return translated_text
 
+    def do_translate_batch(self, texts) -> list[str]:
+        response = self.client.translate(
+            body=texts,
+            from_language=self.lang_in,
+            to_language=[self.lang_out],
+        )
+        return [item.translations[0].text for item in response]
+
 
 class TencentTranslator(BaseTranslator):
     # https://github.com/TencentCloud/tencentcloud-sdk-python
@@ -694,6 +1146,8 @@ class TencentTranslator(BaseTranslator):
         "TENCENTCLOUD_SECRET_ID": None,
         "TENCENTCLOUD_SECRET_KEY": None,
     }
+    batch_size = 100  # https://cloud.tencent.com/document/api/551/40566
+    batch_chars = 6000
 
     def __init__(
         self, lang_in, lang_out, model, envs=None, ignore_cache=False, **kwargs
@@ -708,16 +1162,25 @@ class TencentTranslator(BaseTranslator):
                 self.envs["TENCENTCLOUD_SECRET_KEY"],
             )
         self.client = TmtClient(cred, "ap-beijing")
-        self.req = TextTranslateRequest()
-        self.req.Source = self.lang_in
-        self.req.Target = self.lang_out
-        self.req.ProjectId = 0
 
     def do_translate(self, text):
-        self.req.SourceText = text
-        resp: TextTranslateResponse = self.client.TextTranslate(self.req)
+        req = TextTranslateRequest()
+        req.Source = self.lang_in
+        req.Target = self.lang_out
+        req.ProjectId = 0
+        req.SourceText = text
+        resp: TextTranslateResponse = self.client.TextTranslate(req)
         return resp.TargetText
 
+    def do_translate_batch(self, texts):
+        req = TextTranslateBatchRequest()
+        req.Source = self.lang_in
+        req.Target = self.lang_out
+        req.ProjectId = 0
+        req.SourceTextList = texts
+        resp: TextTranslateBatchResponse = self.client.TextTranslateBatch(req)
+        return resp.TargetTextList
+
 
 class AnythingLLMTranslator(BaseTranslator):
     name = "anythingllm"
@@ -758,6 +1221,23 @@ class AnythingLLMTranslator(BaseTranslator):
         if "textResponse" in data:
             return data["textResponse"].strip()
 
+    async def ado_translate(self, text):
+        messages = self.prompt(text, self.prompttext)
+        payload = {
+            "message": messages,
+            "mode": "chat",
+            "sessionId": "translation_expert",
+        }
+
+        response = await self.get_aclient().post(
+            self.api_url, headers=self.headers, content=json.dumps(payload)
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        if "textResponse" in data:
+            return data["textResponse"].strip()
+
 
 class DifyTranslator(BaseTranslator):
     name = "dify"
@@ -800,6 +1280,30 @@ class DifyTranslator(BaseTranslator):
         # 解析响应
         return response_data.get("answer", "")
 
+    async def ado_translate(self, text):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+
+        payload = {
+            "inputs": {
+                "lang_out": self.lang_out,
+                "lang_in": self.lang_in,
+                "text": text,
+            },
+            "response_mode": "blocking",
+            "user": "translator-service",
+        }
+
+        response = await self.get_aclient().post(
+            self.api_url, headers=headers, content=json.dumps(payload)
+        )
+        response.raise_for_status()
+        response_data = response.json()
+
+        return response_data.get("answer", "")
+
 
 class ArgosTranslator(BaseTranslator):
     name = "argos"
@@ -852,6 +1356,9 @@ class ArgosTranslator(BaseTranslator):
         translatedText = translation.translate(text)
         return translatedText
 
+    async def atranslate(self, text: str, ignore_cache: bool = False):
+        return await asyncio.to_thread(self.translate, text, ignore_cache)
+
 
 class GrokTranslator(OpenAITranslator):
     # https://docs.x.ai/docs/overview#getting-started
@@ -986,6 +1493,7 @@ class QwenMtTranslator(OpenAITranslator):
         "ALI_DOMAINS": "This sentence is extracted from a scientific paper. When translating, please pay close attention to the use of specialized troubleshooting terminologies and adhere to scientific sentence structures to maintain the technical rigor and precision of the original text.",
     }
     CustomPrompt = True
+    batch_size = 1  # translation_options 只支持单条文本
 
     def __init__(
         self, lang_in, lang_out, model, envs=None, prompt=None, ignore_cache=False
@@ -1046,3 +1554,17 @@ class QwenMtTranslator(OpenAITranslator):
             extra_body={"translation_options": translation_options},
         )
         return response.choices[0].message.content.strip()
+
+    async def ado_translate(self, text) -> str:
+        translation_options = {
+            "source_lang": self.lang_mapping(self.lang_in),
+            "target_lang": self.lang_mapping(self.lang_out),
+            "domains": self.envs["ALI_DOMAINS"],
+        }
+        response = await self.get_aclient().chat.completions.create(
+            model=self.model,
+            **self.options,
+            messages=[{"role": "user", "content": text}],
+            extra_body={"translation_options": translation_options},
+        )
+        return response.choices[0].message.content.strip()
@@ -0,0 +1,110 @@
+"""
+Compare the Char records built by PDFConverterEx.render_char with pdfminer's LTChar.
+
+All pages of the given PDFs are interpreted with both record types, keeping every
+record alive as the converter does until a page is parsed. The time per run and the
+peak memory of the records are reported.
+
+Usage: python script/bench_chars.py [--repeat N] [pdf ...]
+"""
+
+import argparse
+import glob
+import sys
+import time
+import tracemalloc
+
+from pdfminer.layout import LTChar
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdffont import PDFUnicodeNotDefined
+from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+
+from pdf2zh.converter import PDFConverterEx
+
+
+class CharCollector(PDFConverterEx):
+    """Keeps the parsed pages instead of translating them."""
+
+    def __init__(self, rsrcmgr):
+        super().__init__(rsrcmgr)
+        self.pages = []
+        self.chars = 0
+
+    def receive_layout(self, ltpage):
+        self.pages.append(ltpage)
+        self.chars += sum(1 for _ in ltpage)
+
+
+class LTCharCollector(CharCollector):
+    """The previous render_char, one LTChar per glyph."""
+
+    def render_char(
+        self, matrix, font, fontsize, scaling, rise, cid, ncs, graphicstate
+    ):
+        try:
+            text = font.to_unichr(cid)
+        except PDFUnicodeNotDefined:
+            text = self.handle_undefined_char(font, cid)
+        item = LTChar(
+            matrix,
+            font,
+            fontsize,
+            scaling,
+            rise,
+            text,
+            font.char_width(cid),
+            font.char_disp(cid),
+            ncs,
+            graphicstate,
+        )
+        self.cur_item.add(item)
+        item.cid = cid
+        item.font = font
+        return item.adv
+
+
+def interpret(files: list[str], collector_class) -> CharCollector:
+    rsrcmgr = PDFResourceManager()
+    device = collector_class(rsrcmgr)
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    for file in files:
+        with open(file, "rb") as f:
+            doc = PDFDocument(PDFParser(f))
+            for pageno, page in enumerate(PDFPage.create_pages(doc)):
+                page.pageno = pageno
+                interpreter.process_page(page)
+    return device
+
+
+def bench(files: list[str], collector_class, repeat: int) -> tuple:
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        interpret(files, collector_class)
+        times.append(time.perf_counter() - t)
+    tracemalloc.start()
+    device = interpret(files, collector_class)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return device.chars, min(times), peak
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("files", nargs="*")
+    options = parser.parse_args(args)
+    files = options.files or sorted(glob.glob("test/file/*.pdf"))
+    for name, collector_class in (("LTChar", LTCharCollector), ("Char", CharCollector)):
+        chars, seconds, peak = bench(files, collector_class, options.repeat)
+        print(
+            f"{name:>6}: {chars} chars, {seconds * 1000:.1f} ms, "
+            f"{seconds / max(chars, 1) * 1e6:.2f} us/char, peak {peak / 2**20:.1f} MiB"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
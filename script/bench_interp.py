@@ -0,0 +1,203 @@
+"""
+Compare PDFPageInterpreterEx.execute with the previous implementation, which looked
+up the handler of every operator with hasattr/getattr and concatenated the copied
+operators into one string.
+
+The pages of the given PDFs are interpreted without translating them and without
+rendering the glyphs, once the documents and fonts are loaded. The copied page
+streams of both implementations must be identical. Most of the time goes to parsing
+the content streams, so they are also parsed once and replayed, which leaves the
+operator dispatch and the output.
+
+Usage: python script/bench_interp.py [--repeat N] [pdf ...]
+"""
+
+import argparse
+import glob
+import io
+import sys
+import time
+
+from pdfminer import settings
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfinterp import PDFInterpreterError, PDFResourceManager
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfparser import PDFParser
+from pdfminer.psexceptions import PSEOF
+from pdfminer.psparser import PSKeyword, keyword_name
+
+import pdf2zh.pdfinterp
+from pdf2zh.converter import PDFConverterEx
+from pdf2zh.pdfinterp import PDFContentParser, PDFPageInterpreterEx
+
+PARSER = PDFContentParser
+
+
+class Device(PDFConverterEx):
+    """Drops the glyphs and the parsed pages."""
+
+    def render_string(self, textstate, seq, ncs, graphicstate):
+        pass
+
+    def receive_layout(self, ltpage):
+        return b""
+
+
+class RecordingParser(PDFContentParser):
+    """Records the objects of every content stream in the order they are parsed."""
+
+    recorded: list = []
+
+    def __init__(self, streams):
+        self.objects = None  # 空的内容流
+        RecordingParser.recorded.append(self)
+        super().__init__(streams)
+        self.objects = []
+
+    def nextobject(self):
+        obj = super().nextobject()
+        self.objects.append(obj)
+        return obj
+
+
+class ReplayParser:
+    """Returns the recorded objects instead of parsing the content streams again."""
+
+    recorded = iter([])
+
+    def __init__(self, streams):
+        objects = next(ReplayParser.recorded).objects
+        if objects is None:
+            raise PSEOF
+        self.objects = iter(objects)
+
+    def nextobject(self):
+        try:
+            return next(self.objects)
+        except StopIteration:
+            raise PSEOF
+
+
+def use_parser(parser_class):
+    global PARSER
+    PARSER = pdf2zh.pdfinterp.PDFContentParser = parser_class
+
+
+class PreviousInterpreter(PDFPageInterpreterEx):
+    """The previous execute."""
+
+    def execute(self, streams):
+        ops = ""
+        try:
+            parser = PARSER(streams)
+        except PSEOF:
+            return
+        while True:
+            try:
+                _, obj = parser.nextobject()
+            except PSEOF:
+                break
+            if isinstance(obj, PSKeyword):
+                name = keyword_name(obj)
+                method = "do_%s" % name.replace("*", "_a").replace('"', "_w").replace(
+                    "'",
+                    "_q",
+                )
+                if hasattr(self, method):
+                    func = getattr(self, method)
+                    nargs = func.__code__.co_argcount - 1
+                    if nargs:
+                        args = self.pop(nargs)
+                        if len(args) == nargs:
+                            func(*args)
+                            if not (
+                                name[0] == "T"
+                                or name in ['"', "'", "EI", "MP", "DP", "BMC", "BDC"]
+                            ):
+                                p = " ".join(
+                                    [
+                                        (
+                                            f"{x:f}"
+                                            if isinstance(x, float)
+                                            else str(x).replace("'", "")
+                                        )
+                                        for x in args
+                                    ]
+                                )
+                                ops += f"{p} {name} "
+                    else:
+                        targs = func()
+                        if targs is None:
+                            targs = []
+                        if not (name[0] == "T" or name in ["BI", "ID", "EMC"]):
+                            p = " ".join(
+                                [
+                                    (
+                                        f"{x:f}"
+                                        if isinstance(x, float)
+                                        else str(x).replace("'", "")
+                                    )
+                                    for x in targs
+                                ]
+                            )
+                            ops += f"{p} {name} "
+                elif settings.STRICT:
+                    raise PDFInterpreterError("Unknown operator: %r" % name)
+            else:
+                self.push(obj)
+        return ops
+
+
+def load(files: list[str]) -> list:
+    pages = []
+    for file in files:
+        with open(file, "rb") as f:
+            doc = PDFDocument(PDFParser(io.BytesIO(f.read())))
+        for pageno, page in enumerate(PDFPage.create_pages(doc)):
+            page.pageno = pageno
+            page.page_xref = page.pageid
+            pages.append(page)
+    return pages
+
+
+def interpret(rsrcmgr, pages: list, interpreter_class) -> dict:
+    obj_patch = {}
+    interpreter = interpreter_class(rsrcmgr, Device(rsrcmgr), obj_patch)
+    for page in pages:
+        interpreter.process_page(page)
+    return obj_patch
+
+
+def main(args: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("files", nargs="*")
+    options = parser.parse_args(args)
+    files = options.files or sorted(glob.glob("test/file/*.pdf"))
+    implementations = {"previous": PreviousInterpreter, "table": PDFPageInterpreterEx}
+    # 文档对象和字体在第一遍中解析并缓存，计时只包含页面的解释
+    rsrcmgr = PDFResourceManager(caching=True)
+    pages = load(files)
+    use_parser(RecordingParser)
+    interpret(rsrcmgr, pages, PDFPageInterpreterEx)
+    for mode, parser_class in (("parse", PDFContentParser), ("replay", ReplayParser)):
+        use_parser(parser_class)
+        times = {name: [] for name in implementations}
+        patches = {}
+        for _ in range(options.repeat):  # 交替运行，减少机器负载波动的影响
+            for name, interpreter_class in implementations.items():
+                ReplayParser.recorded = iter(RecordingParser.recorded)
+                t = time.perf_counter()
+                patches[name] = interpret(rsrcmgr, pages, interpreter_class)
+                times[name].append(time.perf_counter() - t)
+        assert patches["previous"] == patches["table"]
+        print(
+            f"{mode:>6}: previous {min(times['previous']) * 1000:.1f} ms, "
+            f"table {min(times['table']) * 1000:.1f} ms, "
+            f"{min(times['previous']) / min(times['table']):.2f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
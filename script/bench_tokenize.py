@@ -0,0 +1,56 @@
+"""
+Compare scanning translated paragraphs for {vn} formula marks by matching at every
+position of the remaining string (the previous typesetting loop) with tokenize.
+
+Usage: python script/bench_tokenize.py [length ...]
+"""
+
+import re
+import sys
+import timeit
+
+from pdf2zh.converter import tokenize
+
+
+def scan_slices(new: str) -> int:
+    marks = 0
+    ptr = 0
+    while ptr < len(new):
+        vy_regex = re.match(r"\{\s*v([\d\s]+)\}", new[ptr:], re.IGNORECASE)
+        if vy_regex:
+            ptr += len(vy_regex.group(0))
+            marks += 1
+        else:
+            ptr += 1
+    return marks
+
+
+def scan_tokens(new: str) -> int:
+    return sum(1 for token in tokenize(new) if not isinstance(token, str))
+
+
+def paragraph(length: int) -> str:
+    # 一句译文加一个公式标记，重复到指定长度
+    unit = "这是一段用于测试排版的译文，其中包含公式 "
+    text = ""
+    while len(text) < length:
+        text += unit + f"{{v{len(text) % 97}}}"
+    return text[:length]
+
+
+def main(lengths: list[int]) -> int:
+    for length in lengths:
+        new = paragraph(length)
+        assert scan_slices(new) == scan_tokens(new)
+        number = max(1, 20000 // length)
+        slices = timeit.timeit(lambda: scan_slices(new), number=number) / number
+        tokens = timeit.timeit(lambda: scan_tokens(new), number=number) / number
+        print(
+            f"{length:>6} chars: slices {slices * 1000:8.2f} ms, "
+            f"tokenize {tokens * 1000:6.2f} ms, {slices / tokens:5.1f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main([int(n) for n in sys.argv[1:]] or [100, 1000, 10000, 50000]))
@@ -0,0 +1,76 @@
+"""
+Compare the INT8 layout model with the FP32 one on the test fixtures.
+
+Every FP32 box is matched to the INT8 box of the same class with the highest IoU.
+The mean IoU, the share of boxes matched with IoU >= 0.5 and the inference time
+of both models are reported.
+
+Usage: python script/layout_int8_accuracy.py [pdf ...]
+"""
+
+import glob
+import sys
+import time
+
+import numpy as np
+import pymupdf
+
+from pdf2zh.doclayout import OnnxModel, session_config
+from pdf2zh.high_level import pixmap_image
+from babeldoc.assets.assets import get_doclayout_onnx_model_path
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(x1 - x0, 0) * max(y1 - y0, 0)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def match(ref, test) -> list[float]:
+    ious = []
+    for box in ref.boxes:
+        candidates = [
+            iou(box.xyxy, other.xyxy) for other in test.boxes if other.cls == box.cls
+        ]
+        ious.append(max(candidates, default=0.0))
+    return ious
+
+
+def main(files: list[str]) -> int:
+    model_path = get_doclayout_onnx_model_path()
+    options = session_config()
+    fp32 = OnnxModel(model_path, {**options, "int8": False})
+    int8 = OnnxModel(model_path, {**options, "int8": True})
+    # Cached layouts would hide the inference time
+    fp32.layout_cache = int8.layout_cache = None
+    ious = []
+    times = {"fp32": 0.0, "int8": 0.0}
+    for file in files:
+        doc = pymupdf.open(file)
+        for page in doc:
+            pix = page.get_pixmap()
+            image = pixmap_image(pix)
+            imgsz = int(pix.height / 32) * 32
+            results = {}
+            for name, model in (("fp32", fp32), ("int8", int8)):
+                t = time.perf_counter()
+                results[name] = model.predict(image, imgsz=imgsz)[0]
+                times[name] += time.perf_counter() - t
+            page_ious = match(results["fp32"], results["int8"])
+            ious.extend(page_ious)
+            print(
+                f"{file} page {page.number}: {len(results['fp32'].boxes)} boxes, "
+                f"mean IoU {np.mean(page_ious) if page_ious else 1.0:.3f}"
+            )
+    ious = np.array(ious)
+    print(f"boxes: {len(ious)}")
+    print(f"mean IoU: {ious.mean() if len(ious) else 1.0:.4f}")
+    print(f"IoU >= 0.5: {(ious >= 0.5).mean() if len(ious) else 1.0:.2%}")
+    print(f"time fp32: {times['fp32']:.2f}s, int8: {times['int8']:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:] or sorted(glob.glob("test/file/*.pdf"))))
@@ -1,3 +1,4 @@
+import os
 import unittest
 from pdf2zh import cache
 import threading
@@ -159,6 +160,168 @@ class TestCache(unittest.TestCase):
         cache_instance.set("hello2", "你好2")
         self.assertEqual(cache_instance.get("hello2"), "你好2")
 
+    def test_get_set_many(self):
+        """Test bulk lookups and inserts"""
+        cache_instance = cache.TranslationCache("test_engine", {"p": 1})
+        other_instance = cache.TranslationCache("test_engine", {"p": 2})
+
+        # More texts than fit into a single query
+        texts = [f"text {i}" for i in range(cache.MAX_VARIABLES * 2)]
+        cache_instance.set_many((text, f"翻译 {text}") for text in texts[::2])
+        other_instance.set("text 1", "other")
+
+        result = cache_instance.get_many(texts)
+        self.assertEqual(len(result), len(texts) // 2)
+        self.assertEqual(result["text 0"], "翻译 text 0")
+        self.assertNotIn("text 1", result)
+        self.assertEqual(cache_instance.get("text 2"), "翻译 text 2")
+
+        # set_many overwrites existing entries
+        cache_instance.set_many([("text 0", "new")])
+        self.assertEqual(
+            cache_instance.get_many(["text 0", "text 0"]), {"text 0": "new"}
+        )
+
+    @staticmethod
+    def create_v1_db(v1_path):
+        v1_db = cache.SqliteDatabase(v1_path)
+        with v1_db.bind_ctx([cache._TranslationCache]):
+            v1_db.create_tables([cache._TranslationCache])
+            params = cache.TranslationCache("test_engine", {"b": 1, "a": 2})
+            for text, translation in [("hello", "你好"), ("hello", "您好"), ("a", "b")]:
+                cache._TranslationCache.create(
+                    translate_engine="test_engine",
+                    translate_engine_params=params.translate_engine_params,
+                    original_text=text,
+                    translation=translation,
+                )
+        v1_db.close()
+
+    def test_migrate_v1(self):
+        """Test migrating entries from the v1 schema"""
+        import tempfile
+
+        v1_path = tempfile.mktemp(suffix=".v1.db")
+        self.create_v1_db(v1_path)
+        cache.migrate_v1(v1_path, self.test_db)
+        os.remove(v1_path)
+        cache_instance = cache.TranslationCache("test_engine", {"a": 2, "b": 1})
+        self.assertEqual(
+            cache_instance.get_many(["hello", "a"]), {"hello": "您好", "a": "b"}
+        )
+        other_instance = cache.TranslationCache("other_engine", {"a": 2, "b": 1})
+        self.assertIsNone(other_instance.get("hello"))
+
+    def test_init_db_migrates_v1(self):
+        """Test that init_db migrates the v1 cache through a per-process temporary file"""
+        import tempfile
+        from unittest import mock
+
+        with tempfile.TemporaryDirectory() as home:
+            folder = os.path.join(home, ".cache", "pdf2zh")
+            os.makedirs(folder)
+            self.create_v1_db(os.path.join(folder, "cache.v1.db"))
+            stale = os.path.join(folder, "cache.v2.db.tmp")
+            open(stale, "w").close()  # 其他进程遗留的临时文件不受影响
+            with mock.patch("os.path.expanduser", return_value=home):
+                cache.init_db()
+            cache.db.close()
+            self.assertEqual(
+                sorted(os.listdir(folder)),
+                ["cache.v1.db", "cache.v2.db", "cache.v2.db.tmp"],
+            )
+            self.assertEqual(self.count_v2(os.path.join(folder, "cache.v2.db")), 2)
+
+    @staticmethod
+    def count_v2(v2_path):
+        v2_db = cache.SqliteDatabase(v2_path)
+        with v2_db.bind_ctx([cache._TranslationParams, cache._TranslationCacheV2]):
+            v2_db.create_tables([cache._TranslationParams, cache._TranslationCacheV2])
+            count = cache._TranslationCacheV2.select().count()
+        v2_db.close()
+        return count
+
+    def test_init_db_concurrent_migration(self):
+        """Test that a migration finishing last does not replace the database in use"""
+        import tempfile
+        from unittest import mock
+
+        with tempfile.TemporaryDirectory() as home:
+            folder = os.path.join(home, ".cache", "pdf2zh")
+            os.makedirs(folder)
+            self.create_v1_db(os.path.join(folder, "cache.v1.db"))
+            v2_path = os.path.join(folder, "cache.v2.db")
+            migrate_v1 = cache.migrate_v1
+
+            def migrate_late(v1_path, v2_db):
+                migrate_v1(v1_path, v2_db)
+                self.count_v2(v2_path)  # 另一个进程先完成迁移，得到空的数据库
+
+            with mock.patch("os.path.expanduser", return_value=home):
+                with mock.patch.object(cache, "migrate_v1", migrate_late):
+                    cache.init_db()
+            cache.db.close()
+            self.assertEqual(sorted(os.listdir(folder)), ["cache.v1.db", "cache.v2.db"])
+            self.assertEqual(self.count_v2(v2_path), 0)
+
+    def test_init_db_remove_exists(self):
+        """Test that removing the cache does not migrate the v1 cache back"""
+        import tempfile
+        from unittest import mock
+
+        with tempfile.TemporaryDirectory() as home:
+            folder = os.path.join(home, ".cache", "pdf2zh")
+            os.makedirs(folder)
+            self.create_v1_db(os.path.join(folder, "cache.v1.db"))
+            with mock.patch("os.path.expanduser", return_value=home):
+                cache.init_db()
+                cache.db.close()
+                cache.init_db(remove_exists=True)
+            cache.db.close()
+            self.assertNotIn("cache.v1.db", os.listdir(folder))
+            self.assertEqual(self.count_v2(os.path.join(folder, "cache.v2.db")), 0)
+
+    def test_memory_cache(self):
+        """Test the in-memory tier in front of the database"""
+        cache_instance = cache.TranslationCache("test_engine")
+        cache_instance.set("hello", "你好")
+        self.assertEqual(cache.memory_cache.stats()["entries"], 1)
+
+        # Served from memory without touching the database
+        cache.clean_test_db(self.test_db)
+        self.assertEqual(cache_instance.get("hello"), "你好")
+        self.assertEqual(cache_instance.get_many(["hello"]), {"hello": "你好"})
+        self.assertEqual(cache.memory_cache.stats()["hits"], 2)
+        self.test_db = cache.init_test_db()
+
+        # Entries found in the database are kept in memory
+        cache_instance.set("world", "世界")
+        cache.memory_cache.clear()
+        self.assertEqual(cache_instance.get("world"), "世界")
+        self.assertEqual(cache_instance.get("world"), "世界")
+        self.assertEqual(cache.memory_cache.stats()["hits"], 1)
+        self.assertEqual(cache.memory_cache.stats()["misses"], 1)
+
+    def test_lru_limits(self):
+        """Test eviction by number of entries and by size"""
+        lru = cache.LRUCache(max_entries=2, max_bytes=1 << 20)
+        lru.put((0, "a"), "1")
+        lru.put((0, "b"), "2")
+        lru.get((0, "a"))
+        lru.put((0, "c"), "3")
+        self.assertIsNone(lru.get((0, "b")))
+        self.assertEqual(lru.get((0, "a")), "1")
+        self.assertEqual(lru.get((0, "c")), "3")
+
+        lru = cache.LRUCache(max_entries=100, max_bytes=1000)
+        for i in range(10):
+            lru.put((0, str(i)), "x" * 200)
+        self.assertLessEqual(lru.stats()["bytes"], 1000)
+        self.assertIsNone(lru.get((0, "0")))
+        self.assertEqual(lru.get((0, "9")), "x" * 200)
+        lru.put((0, "big"), "x" * 2000)
+        self.assertIsNone(lru.get((0, "big")))
+
     # Sometimes the problem of "database is locked" occurs. Temporarily disable this test.
     # def test_thread_safety(self):
     #     """Test thread safety of cache operations"""
@@ -211,5 +374,60 @@ class TestCache(unittest.TestCase):
     #         self.assertEqual(result, expected)
 
 
+class FakeRedis:
+    """In-process stand-in for the redis client, only the hash commands we use."""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def hsetnx(self, name, key, value):
+        h = self.hashes.setdefault(name, {})
+        if key in h:
+            return 0
+        h[key] = value.encode()
+        return 1
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        h = self.hashes.setdefault(name, {})
+        if key is not None:
+            mapping = {key: value}
+        for k, v in mapping.items():
+            h[k] = v.encode()
+        return len(mapping)
+
+    def hmget(self, name, keys):
+        h = self.hashes.get(name, {})
+        return [h.get(k) for k in keys]
+
+
+class TestRedisBackend(unittest.TestCase):
+    def setUp(self):
+        self.backend = cache.backend
+        self.redis = FakeRedis()
+        cache.backend = cache.RedisBackend(client=self.redis)
+        cache.memory_cache.clear()
+
+    def tearDown(self):
+        cache.backend = self.backend
+        cache.memory_cache.clear()
+
+    def test_set_get(self):
+        cache_instance = cache.TranslationCache("test_engine", {"a": 1})
+        self.assertIsNone(cache_instance.get("hello"))
+        cache_instance.set("hello", "你好")
+        cache_instance.set_many([("world", "世界"), ("hello", "您好")])
+
+        # Another worker with a cold memory cache sees the same entries
+        cache.memory_cache.clear()
+        other_worker = cache.TranslationCache("test_engine", {"a": 1})
+        self.assertEqual(other_worker.get("hello"), "您好")
+        self.assertEqual(
+            other_worker.get_many(["hello", "world", "missing"]),
+            {"hello": "您好", "world": "世界"},
+        )
+        self.assertIsNone(cache.TranslationCache("test_engine", {"a": 2}).get("hello"))
+        self.assertEqual(len(self.redis.hashes["pdf2zh:cache:params"]), 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -1,8 +1,25 @@
+import os
+import tempfile
 import unittest
-from unittest.mock import Mock, patch, MagicMock
+from unittest.mock import AsyncMock, Mock, patch
+import numpy as np
+from pymupdf import Font
 from pdfminer.layout import LTPage, LTChar, LTLine
+from pdfminer.pdffont import PDFUnicodeNotDefined
 from pdfminer.pdfinterp import PDFResourceManager
-from pdf2zh.converter import PDFConverterEx, TranslateConverter
+from pdfminer.psparser import KWD
+from pdf2zh.converter import (
+    Char,
+    FontMetrics,
+    OpsWriter,
+    PDFConverterEx,
+    PendingOps,
+    TranslateConverter,
+    font_metrics,
+    pdf_number,
+    tokenize,
+)
+from pdf2zh.pdfinterp import PDFPageInterpreterEx, PendingPatch, make_patch
 
 
 class TestPDFConverterEx(unittest.TestCase):
@@ -39,6 +56,113 @@ class TestPDFConverterEx(unittest.TestCase):
         )
         self.assertEqual(result, 120.0)  # Expected text width
 
+    def test_char_matches_ltchar(self):
+        matrix = (0.5, 0.1, -0.2, 1.5, 30, 40)
+        for vertical, textdisp in ((False, 0.5), (True, (None, 880)), (True, (20, 0))):
+            font = Mock(fontname="F1")
+            font.is_vertical.return_value = vertical
+            font.get_descent.return_value = -0.2
+            args = (matrix, font, 12, 0.9, 1.5, "A", 0.6, textdisp)
+            char = Char(*args, 65)
+            ltchar = LTChar(*args, None, None)
+            for field in ("x0", "y0", "x1", "y1", "width", "size", "adv", "fontname"):
+                self.assertEqual(getattr(char, field), getattr(ltchar, field))
+            self.assertEqual(char.get_text(), ltchar.get_text())
+
+    def test_render_char_cache(self):
+        mock_font = Mock()
+        mock_font.to_unichr.side_effect = PDFUnicodeNotDefined(None, 1)
+        mock_font.char_width.return_value = 10
+        mock_font.char_disp.return_value = (0, 0)
+        self.converter.cur_item = Mock()
+        for _ in range(3):
+            self.converter.render_char(
+                (1, 0, 0, 1, 0, 0), mock_font, 12, 1.0, 0, 1, None, Mock()
+            )
+        # Each (font, cid) is resolved once, undefined chars included
+        mock_font.to_unichr.assert_called_once_with(1)
+        mock_font.char_width.assert_called_once_with(1)
+        item = self.converter.cur_item.add.call_args[0][0]
+        self.assertEqual(item.get_text(), "(cid:1)")
+
+
+class TestFontMetrics(unittest.TestCase):
+    def setUp(self):
+        self.font = Font("helv")
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "helv.ttf")
+        with open(self.path, "wb") as f:
+            f.write(self.font.buffer)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_matches_font(self):
+        for metrics in (FontMetrics(self.font), FontMetrics(self.font, self.path)):
+            for ch in "Ag 中\U0001d400":
+                self.assertEqual(metrics.glyph(ord(ch)), self.font.has_glyph(ord(ch)))
+                self.assertEqual(
+                    metrics.advance(ord(ch)) * 10.5,
+                    self.font.char_lengths(ch, 10.5)[0],
+                )
+
+    def test_persisted(self):
+        FontMetrics(self.font, self.path)
+        self.assertEqual(len(os.listdir(self.folder.name)), 2)
+        # 已保存的码表直接加载，不再查询字体
+        metrics = FontMetrics(Mock(), self.path)
+        self.assertEqual(metrics.glyph(ord("A")), self.font.has_glyph(ord("A")))
+        self.assertEqual(metrics.advance(ord("A")), self.font.glyph_advance(ord("A")))
+        self.assertIs(
+            font_metrics(self.font, self.path), font_metrics(Mock(), self.path)
+        )
+
+
+class TestOpsWriter(unittest.TestCase):
+    def test_pdf_number(self):
+        self.assertEqual(pdf_number(12.0), b"12")
+        self.assertEqual(pdf_number(-0.0000001), b"0")
+        self.assertEqual(pdf_number(0.1234567), b"0.123457")
+        self.assertEqual(pdf_number(-2.5004, 3), b"-2.5")
+
+    def test_text_state(self):
+        writer = OpsWriter()
+        writer.text("noto", 10.0, 10, 700, b"0001")
+        writer.text("noto", 10.0, 50, 700, b"0002")
+        writer.text("tiro", 10.0, 10, 686, b"41")
+        # 字体不变时不重复 Tf，位置相对于上一行起点
+        self.assertEqual(
+            writer.getvalue(),
+            b"BT /noto 10 Tf 10 700 Td <0001> Tj 40 0 Td <0002> Tj "
+            b"/tiro 10 Tf -40 -14 Td <41> Tj ET ",
+        )
+
+    def test_text_array(self):
+        writer = OpsWriter()
+        writer.text("F1", 10.0, 10, 700, b"61", 0.5)
+        writer.text("F1", 10.0, 15, 700, b"62", 0.5)
+        writer.text("F1", 10.0, 22, 700, b"63", 0.5)
+        writer.text("F1", 10.0, 30, 690, b"64", 0.5)
+        # 同一基线的字符合并为一个 TJ，间隙换算为字距
+        self.assertEqual(
+            writer.getvalue(),
+            b"BT /F1 10 Tf 10 700 Td [<6162>-200<63>] TJ 20 -10 Td <64> Tj ET ",
+        )
+
+    def test_line(self):
+        writer = OpsWriter()
+        writer.text("F1", 10.0, 10, 700, b"61")
+        writer.line(10, 690, 30, 0, 0.5)
+        writer.line(10, 680, 30, 0, 0.5)
+        writer.text("F1", 10.0, 50, 700, b"62")
+        writer.line(10, 670, 0, 10, 1)
+        self.assertEqual(
+            writer.getvalue(),
+            b"BT /F1 10 Tf 10 700 Td <61> Tj ET q [] 0 d 0 J 0.5 w "
+            b"10 690 m 40 690 l S 10 680 m 40 680 l S Q BT 50 700 Td <62> Tj "
+            b"ET q [] 0 d 0 J 1 w 10 670 m 10 680 l S Q ",
+        )
+
 
 class TestTranslateConverter(unittest.TestCase):
     def setUp(self):
@@ -87,14 +211,198 @@ class TestTranslateConverter(unittest.TestCase):
         ltline = LTLine(0.1, (0, 0), (10, 20))
         ltpage.add(ltchar)
         ltpage.add(ltline)
-        mock_layout = MagicMock()
-        mock_layout.shape = (100, 100)
-        mock_layout.__getitem__.return_value = -1
-        self.converter.layout = [None, mock_layout]
+        self.converter.layout = [None, np.full((100, 100), -1)]
         self.converter.thread = 1
         result = self.converter.receive_layout(ltpage)
         self.assertIsNotNone(result)
 
+    def test_parse_layout_classes(self):
+        def char(text, x, fontname="Times-Roman"):
+            font = Mock(fontname=fontname)
+            font.is_vertical.return_value = False
+            font.get_descent.return_value = 0
+            return Char(
+                (1, 0, 0, 1, x, 50), font, 10, 1.0, 0, text, 0.5, None, ord(text)
+            )
+
+        ltpage = LTPage(1, (0, 0, 100, 100))
+        for i, text in enumerate("ab"):
+            ltpage.add(char(text, 10 + 5 * i))
+        ltpage.add(char("x", 20, fontname="ABCDEF+CMMI10"))  # 公式字体
+        for i, text in enumerate("cd"):
+            ltpage.add(char(text, 60 + 5 * i))
+        layout = np.ones((100, 100), dtype=np.uint8)
+        layout[:, :50] = 2
+        layout[:, 50:] = 3
+        self.converter.layout = {1: layout}
+        parsed = self.converter.parse_layout(ltpage)
+        # 两个版面区域各自成段，公式字体的字符成为公式
+        self.assertEqual(parsed.sstk, ["ab{v0}", "cd"])
+        self.assertEqual([c.get_text() for c in parsed.var[0]], ["x"])
+
+    def test_vflag(self):
+        self.assertTrue(self.converter.vflag("ABCDEF+CMMI10", "x"))
+        self.assertTrue(self.converter.vflag(b"CMSY10", "x"))
+        self.assertTrue(self.converter.vflag("Times-Roman", "(cid:12)"))
+        self.assertTrue(self.converter.vflag("Times-Roman", "α"))
+        self.assertFalse(self.converter.vflag("Times-Roman", "x"))
+        # 判定结果按字体名和字符缓存
+        self.assertEqual(
+            self.converter.vfont_cache,
+            {"ABCDEF+CMMI10": True, b"CMSY10": True, "Times-Roman": False},
+        )
+        self.assertFalse(self.converter.vchar_cache["x"])
+
+        converter = TranslateConverter(
+            self.rsrcmgr, vfont="Times", vchar=r"\d", service="google"
+        )
+        self.assertTrue(converter.vflag("Times-Roman", "x"))
+        self.assertTrue(converter.vflag("Arial", "1"))
+        self.assertFalse(converter.vflag("CMMI10", "α"))
+
+    def test_tokenize(self):
+        tokens = tokenize("a{v0}b { V 12 }{v}")
+        self.assertEqual(tokens[0], "a")
+        self.assertEqual(tokens[1].group(1), "0")
+        self.assertEqual(tokens[2:4], ["b", " "])
+        self.assertEqual(tokens[4].group(1), " 12 ")
+        self.assertEqual(tokens[5:], list("{v}"))
+
+    def test_tiro_width(self):
+        font = Mock()
+        font.to_unichr.side_effect = lambda cid: chr(cid) if cid < 0x80 else "?"
+        font.char_width.return_value = 0.5
+        for _ in range(2):
+            self.assertEqual(self.converter.tiro_width(font, "a"), 0.5)
+            self.assertIsNone(self.converter.tiro_width(font, "中"))
+            self.assertIsNone(self.converter.tiro_width(None, "a"))
+        self.assertEqual(font.to_unichr.call_count, 2)
+        font.char_width.assert_called_once_with(ord("a"))
+
+    def test_receive_layout_deferred(self):
+        ltpage = LTPage(1, (0, 0, 500, 500))
+        ltpage.add(LTLine(0.1, (0, 0), (10, 20)))
+        self.converter.layout = [None, np.full((100, 100), -1)]
+        self.converter.thread = 1
+        expected = self.converter.receive_layout(ltpage)
+
+        self.converter.deferred = True
+        pending = self.converter.receive_layout(ltpage)
+        self.assertIsInstance(pending, PendingOps)
+        self.assertEqual(self.converter.pending, [pending])
+        self.assertEqual(pending.result(), expected)
+        self.assertTrue(pending.done())
+        self.converter.close()
+
+    def test_translate_paragraphs_dedup(self):
+        self.converter.thread = 2
+        self.converter.translator = Mock(batch_size=1)
+        self.converter.translator.translate.side_effect = (
+            lambda s, ignore_cache: s.upper()
+        )
+        futures = self.converter.translate_paragraphs(["hello", "{v0}", " ", "hello"])
+        self.assertIs(futures[0], futures[3])
+        self.assertEqual([f.result() for f in futures], ["HELLO", "{v0}", " ", "HELLO"])
+        self.converter.translate_paragraphs(["hello"])
+        self.converter.translator.translate.assert_called_once_with(
+            "hello", ignore_cache=True
+        )
+        self.converter.close()
+
+    def test_translate_paragraphs_two_pass(self):
+        self.converter.thread = 2
+        self.converter.two_pass = True
+        self.converter.translator = Mock(batch_size=1)
+        self.converter.translator.translate.side_effect = (
+            lambda s, ignore_cache: s.upper()
+        )
+        futures = self.converter.translate_paragraphs(["hello", "world"])
+        self.assertFalse(any(f.done() for f in futures))
+        self.converter.translator.translate.assert_not_called()
+        self.converter.flush()
+        self.assertEqual([f.result() for f in futures], ["HELLO", "WORLD"])
+        self.converter.close()
+
+    def test_translate_paragraphs_batch(self):
+        self.converter.thread = 2
+        self.converter.translator = Mock()
+        self.converter.translator.batch_size = 2
+        self.converter.translator.split_batches.side_effect = lambda texts: [
+            texts[i : i + 2] for i in range(0, len(texts), 2)
+        ]
+        self.converter.translator.translate_batch.side_effect = (
+            lambda texts, ignore_cache: [s.upper() for s in texts]
+        )
+        futures = self.converter.translate_paragraphs(["a", "b", "c", "a"])
+        self.assertEqual([f.result() for f in futures], ["A", "B", "C", "A"])
+        self.assertEqual(self.converter.translator.translate_batch.call_count, 2)
+        self.converter.translator.translate.assert_not_called()
+        self.converter.close()
+
+    def test_translate_paragraphs_batch_mismatch(self):
+        self.converter.thread = 2
+        self.converter.translator = Mock(batch_size=2, ignore_cache=True)
+        self.converter.translator.split_batches.side_effect = lambda texts: [texts]
+        self.converter.translator.translate_batch.return_value = ["A"]
+        futures = self.converter.translate_paragraphs(["a", "b"])
+        # A short result fails every paragraph of the batch instead of blocking
+        for future in futures:
+            with self.assertRaises(ValueError):
+                future.result(timeout=5)
+        self.converter.close()
+
+    def test_translate_paragraphs_prefetch(self):
+        self.converter.thread = 2
+        self.converter.translator = Mock(batch_size=1, ignore_cache=False)
+        self.converter.translator.lookup_batch.return_value = (["cached", None], [1])
+        self.converter.translator.translate.side_effect = (
+            lambda s, ignore_cache: s.upper()
+        )
+        futures = self.converter.translate_paragraphs(["a", "b", "a"])
+        self.assertEqual([f.result() for f in futures], ["cached", "B", "cached"])
+        self.converter.translator.lookup_batch.assert_called_once_with(["a", "b"])
+        # 预取之后不再逐条查询缓存
+        self.converter.translator.translate.assert_called_once_with(
+            "b", ignore_cache=True
+        )
+        self.converter.close()
+
+    def test_translate_paragraphs_concurrency(self):
+        self.converter.concurrency = 2
+        self.converter.translator = Mock()
+        self.converter.translator.batch_size = 1
+        self.converter.translator.atranslate = AsyncMock(
+            side_effect=lambda s, ignore_cache: s.upper()
+        )
+        self.converter.translator.aclose = AsyncMock()
+        futures = self.converter.translate_paragraphs(["a", "b", "a", "{v0}"])
+        self.assertEqual([f.result() for f in futures], ["A", "B", "A", "{v0}"])
+        self.assertEqual(self.converter.translator.atranslate.await_count, 2)
+        self.converter.translator.translate.assert_not_called()
+        self.converter.close()
+        self.converter.translator.aclose.assert_awaited_once()
+        self.assertIsNone(self.converter.loop)
+
+    def test_make_patch(self):
+        self.assertEqual(make_patch("q Q ", b"BT ET "), b"q Q BT ET ")
+        ops = Mock()
+        ops.result.return_value = b"BT ET "
+        patch = make_patch("q Q ", ops, strict=False)
+        self.assertIsInstance(patch, PendingPatch)
+        self.assertFalse(patch.strict)
+        self.assertEqual(patch.result(), b"q Q BT ET ")
+
+    def test_operator_table(self):
+        name, func, nargs, copy = PDFPageInterpreterEx.operator(KWD(b"re"))
+        self.assertEqual((name, nargs, copy), ("re", 4, True))
+        self.assertIs(func, PDFPageInterpreterEx.do_re)
+        self.assertEqual(PDFPageInterpreterEx.operator(KWD(b"T*"))[2:], (0, False))
+        self.assertEqual(PDFPageInterpreterEx.operator(KWD(b"BDC"))[2:], (2, False))
+        self.assertIsNone(PDFPageInterpreterEx.operator(KWD(b"xx"))[1])
+        # 分派表按类保存，只解析一次
+        table = PDFPageInterpreterEx.operators()
+        self.assertIs(table[KWD(b"re")], PDFPageInterpreterEx.operator(KWD(b"re")))
+
     def test_invalid_translation_service(self):
         with self.assertRaises(ValueError):
             TranslateConverter(
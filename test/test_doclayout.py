@@ -1,28 +1,40 @@
+import os
+import tempfile
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+from onnxruntime import ExecutionMode
 from pdf2zh.doclayout import (
+    LayoutCache,
     OnnxModel,
     YoloResult,
     YoloBox,
+    quantize_model,
+    session_config,
 )
 
 
 class TestOnnxModel(unittest.TestCase):
-    @patch("onnx.load")
+    @staticmethod
+    def mock_metadata(mock_inference_session):
+        mock_meta = mock_inference_session.return_value.get_modelmeta.return_value
+        mock_meta.custom_metadata_map = {
+            "stride": "32",
+            "names": "['class1', 'class2']",
+        }
+
     @patch("onnxruntime.InferenceSession")
-    def setUp(self, mock_inference_session, mock_onnx_load):
+    def setUp(self, mock_inference_session):
         # Mock ONNX model metadata
-        mock_model = MagicMock()
-        mock_model.metadata_props = [
-            MagicMock(key="stride", value="32"),
-            MagicMock(key="names", value="['class1', 'class2']"),
-        ]
-        mock_onnx_load.return_value = mock_model
+        self.mock_metadata(mock_inference_session)
 
         # Initialize OnnxModel with a fake path
         self.model_path = "fake_model_path.onnx"
         self.model = OnnxModel(self.model_path)
+        # The fake model file cannot identify cached layouts
+        self.model.layout_cache = None
 
     def test_stride_property(self):
         # Test that stride is correctly set from model metadata
@@ -43,6 +55,14 @@ class TestOnnxModel(unittest.TestCase):
         self.assertGreater(padded_height, 0)
         self.assertGreater(padded_width, 0)
 
+    def test_resize_skipped_at_input_size(self):
+        # Pages rendered at the input size go to the model unchanged
+        image = np.random.randint(0, 255, (512, 320, 3), dtype=np.uint8)
+        with patch("cv2.resize") as mock_resize:
+            resized_image = self.model.resize_and_pad_image(image, 512)
+        mock_resize.assert_not_called()
+        np.testing.assert_array_equal(resized_image, image)
+
     def test_scale_boxes(self):
         img1_shape = (1024, 1024)  # Model input shape
         img0_shape = (500, 300)  # Original image shape
@@ -70,6 +90,154 @@ class TestOnnxModel(unittest.TestCase):
         self.assertGreater(len(results[0].boxes), 0)
         self.assertIsInstance(results[0].boxes[0], YoloBox)
 
+    def test_predict_batch(self):
+        mock_output = np.random.random((2, 300, 6))
+        self.model.model.run.return_value = [mock_output]
+
+        # Pages of different sizes are letterboxed into a single batch
+        images = [
+            np.ones((500, 300, 3), dtype=np.uint8),
+            np.ones((400, 300, 3), dtype=np.uint8),
+        ]
+        results = self.model.predict_batch(images, imgsz=[512, 384])
+
+        self.model.model.run.assert_called_once()
+        batch = self.model.model.run.call_args[0][1]["images"]
+        self.assertEqual(batch.shape, (2, 3, 512, 320))
+        self.assertEqual(batch.dtype, np.float32)
+        # 填充区域同样是 float32，numpy 1.x 下 np.full 不会自动推断
+        self.assertEqual(batch[1, 0, -1, -1], np.float32(114 / 255.0))
+        self.assertEqual(len(results), 2)
+        self.assertTrue(all(isinstance(r, YoloResult) for r in results))
+
+    def test_layout_cache(self):
+        mock_output = np.random.random((1, 300, 6))
+        self.model.model.run.return_value = [mock_output]
+        image = np.ones((500, 300, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as folder:
+            model_path = os.path.join(folder, "model.onnx")
+            with open(model_path, "wb") as f:
+                f.write(b"model")
+            self.model.layout_cache = LayoutCache(model_path, folder=folder)
+
+            results = self.model.predict(image)
+            self.assertEqual(self.model.model.run.call_count, 1)
+
+            # The same page is served from the cache, without running the model
+            cached = self.model.predict_batch([image, image])
+            self.assertEqual(self.model.model.run.call_count, 1)
+            for result in cached:
+                self.assertEqual(len(result.boxes), len(results[0].boxes))
+                for box, expected in zip(result.boxes, results[0].boxes):
+                    np.testing.assert_array_equal(box.xyxy, expected.xyxy)
+                    self.assertEqual(box.cls, expected.cls)
+
+            # Another page, or the INT8 model, misses the cache
+            self.model.predict(np.zeros((500, 300, 3), dtype=np.uint8))
+            self.assertEqual(self.model.model.run.call_count, 2)
+            self.model.layout_cache = LayoutCache(model_path, int8=True, folder=folder)
+            self.model.predict(image)
+            self.assertEqual(self.model.model.run.call_count, 3)
+
+    def test_layout_cache_errors(self):
+        self.model.model.run.return_value = [np.random.random((1, 300, 6))]
+        image = np.ones((500, 300, 3), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as folder:
+            model_path = os.path.join(folder, "model.onnx")
+            with open(model_path, "wb") as f:
+                f.write(b"model")
+            # 缓存目录不可写时只记录警告，版面分析照常进行
+            blocked = os.path.join(folder, "blocked")
+            open(blocked, "w").close()
+            self.model.layout_cache = LayoutCache(model_path, folder=blocked)
+            with self.assertLogs("pdf2zh.doclayout", "WARNING"):
+                results = self.model.predict(image)
+            self.assertEqual(len(results), 1)
+            # 模型文件不存在时同样跳过缓存
+            self.model.layout_cache = LayoutCache(
+                os.path.join(folder, "missing.onnx"), folder=folder
+            )
+            with self.assertLogs("pdf2zh.doclayout", "WARNING"):
+                self.model.predict(image)
+            self.assertEqual(self.model.model.run.call_count, 2)
+
+    def test_layout_cache_prune(self):
+        with tempfile.TemporaryDirectory() as folder:
+            cache = LayoutCache("model.onnx", folder=folder, max_size=6000)
+            boxes = np.zeros((100, 6), dtype=np.float32)  # 每条约 2.5 KB
+            for i, key in enumerate(["aa1", "bb2", "cc3"]):
+                cache.put(key, boxes)
+                os.utime(cache._path(key), (i, i))
+            cache.get("aa1")  # 最近读取过的条目被保留
+            cache.prune()
+            self.assertIsNotNone(cache.get("aa1"))
+            self.assertIsNone(cache.get("bb2"))
+            self.assertIsNone(cache.get("cc3"))
+
+    @patch("onnxruntime.InferenceSession")
+    def test_session_options(self, mock_inference_session):
+        self.mock_metadata(mock_inference_session)
+        OnnxModel(
+            self.model_path,
+            {"threads": 2, "inter_threads": 3, "execution_mode": "parallel"},
+        )
+        # The session is created from the file, the model is not parsed in Python
+        self.assertEqual(mock_inference_session.call_args[0][0], self.model_path)
+        options = mock_inference_session.call_args[0][1]
+        self.assertEqual(options.intra_op_num_threads, 2)
+        self.assertEqual(options.inter_op_num_threads, 3)
+        self.assertEqual(options.execution_mode, ExecutionMode.ORT_PARALLEL)
+
+    @patch("pdf2zh.doclayout.ConfigManager.get")
+    def test_session_config(self, mock_get):
+        mock_get.side_effect = lambda key: {
+            "ONNX_THREADS": "4",
+            "ONNX_PROVIDERS": "CPUExecutionProvider",
+        }.get(key)
+        self.assertEqual(
+            session_config(opt_level="basic", threads=None),
+            {"threads": 4, "opt_level": "basic", "providers": ["CPUExecutionProvider"]},
+        )
+        self.assertEqual(session_config(threads=1)["threads"], 1)
+
+    def test_quantize_model(self):
+        # A single convolution is enough to exercise the quantization
+        images = helper.make_tensor_value_info(
+            "images", TensorProto.FLOAT, ["b", 3, "h", "w"]
+        )
+        out = helper.make_tensor_value_info(
+            "out", TensorProto.FLOAT, ["b", 4, "h", "w"]
+        )
+        weight = numpy_helper.from_array(
+            np.random.randn(4, 3, 3, 3).astype(np.float32), "W"
+        )
+        conv = helper.make_node("Conv", ["images", "W"], ["out"], pads=[1, 1, 1, 1])
+        graph = helper.make_graph([conv], "g", [images], [out], [weight])
+        model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+        with tempfile.TemporaryDirectory() as folder:
+            model_path = os.path.join(folder, "model.onnx")
+            onnx.save(model, model_path)
+            int8_path = quantize_model(model_path)
+            self.assertEqual(int8_path, os.path.join(folder, "model.int8.onnx"))
+            ops = [node.op_type for node in onnx.load(int8_path).graph.node]
+            self.assertIn("ConvInteger", ops)
+
+            # The quantized model is cached
+            with patch("onnxruntime.quantization.quantize_dynamic") as mock_quantize:
+                self.assertEqual(quantize_model(model_path), int8_path)
+                mock_quantize.assert_not_called()
+
+    def test_quantize_model_without_onnx(self):
+        # onnx comes with the int8 extra, without it quantization fails with a hint
+        with tempfile.TemporaryDirectory() as folder:
+            model_path = os.path.join(folder, "model.onnx")
+            open(model_path, "wb").close()
+            with patch.dict("sys.modules", {"onnxruntime.quantization": None}):
+                with self.assertLogs("pdf2zh.doclayout", "WARNING") as logs:
+                    with self.assertRaises(ImportError):
+                        quantize_model(model_path)
+            self.assertIn("pdf2zh[int8]", logs.output[0])
+
 
 class TestYoloResult(unittest.TestCase):
     def test_yolo_result(self):
@@ -0,0 +1,250 @@
+import multiprocessing
+import os
+import queue
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import numpy as np
+import pymupdf
+
+from pdf2zh import cache, high_level
+from pdf2zh.doclayout import YoloResult
+from pdf2zh.high_level import (
+    _layout_producer,
+    _next_layout,
+    layout_mask,
+    render_layout,
+    render_page,
+)
+from pdf2zh.translator import GoogleTranslator
+
+
+class StubModel:
+    """Detects one text box in the middle of every page."""
+
+    names = {0: "text", 1: "figure"}
+
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.calls = []
+        self.shapes = []
+
+    def predict_batch(self, images, imgsz=1024, **kwargs):
+        self.calls.append(len(images))
+        self.shapes.extend(image.shape for image in images)
+        if self.error is not None:
+            raise self.error
+        results = []
+        for image in images:
+            h, w = image.shape[:2]
+            boxes = np.array([[w * 0.25, h * 0.25, w * 0.75, h * 0.75, 0.9, 0]])
+            results.append(YoloResult(boxes=boxes, names=self.names))
+        return results
+
+
+def make_doc(page_count: int) -> pymupdf.Document:
+    doc = pymupdf.open()
+    for i in range(page_count):
+        page = doc.new_page(width=200, height=100)
+        page.insert_text((20, 50), f"Page {i}")
+    return doc
+
+
+class TestLayoutProducer(unittest.TestCase):
+    def start(self, doc, model, pages=None, maxsize=4):
+        layouts = queue.Queue(maxsize=maxsize)
+        stop = threading.Event()
+        producer = threading.Thread(
+            target=_layout_producer,
+            args=(doc, pages, model, layouts, stop),
+            daemon=True,
+        )
+        producer.start()
+        self.addCleanup(producer.join, 5)
+        self.addCleanup(stop.set)
+        return layouts, stop, producer
+
+    def test_layouts_in_order(self):
+        model = StubModel()
+        layouts, _, _ = self.start(make_doc(3), model, pages=[0, 2])
+        for pageno in (0, 2):
+            box = _next_layout(layouts, pageno)
+            self.assertEqual(box.shape, (100, 200))
+            self.assertEqual(box[50, 100], 2)  # 检测到的文本框
+            self.assertEqual(box[5, 5], 1)
+        self.assertEqual(model.calls, [2])
+
+    def test_pages_past_the_end(self):
+        # 页面树损坏时 pdfminer 可能比 pymupdf 多出页面，不能一直等待版面
+        layouts, _, _ = self.start(make_doc(2), StubModel())
+        _next_layout(layouts, 0)
+        _next_layout(layouts, 1)
+        with self.assertRaises(IndexError):
+            _next_layout(layouts, 2)
+
+    def test_queue_size(self):
+        layouts, stop, producer = self.start(make_doc(12), StubModel(), maxsize=2)
+        _next_layout(layouts, 0)
+        producer.join(0.5)
+        # 解析没有跟上时，版面分析最多领先队列的长度
+        self.assertTrue(producer.is_alive())
+        self.assertEqual(layouts.qsize(), 2)
+        stop.set()
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+
+    def test_error(self):
+        layouts, _, producer = self.start(make_doc(2), StubModel(ValueError("boom")))
+        with self.assertRaisesRegex(ValueError, "boom"):
+            _next_layout(layouts, 0)
+        producer.join(5)
+        self.assertFalse(producer.is_alive())
+
+
+class TestRenderLayout(unittest.TestCase):
+    def test_layout_dpi(self):
+        page = make_doc(1)[0]
+        model = StubModel()
+        pix, size = render_page(page)
+        expected = render_layout(pix, model, size)
+        # 144 dpi 渲染时页面高度取整到 32 的倍数，检测框缩放回 72 dpi 的版面
+        pix, size = render_page(page, layout_dpi=144)
+        self.assertEqual((pix.height, pix.width), (192, 384))
+        self.assertEqual(size, (100, 200))
+        box = render_layout(pix, model, size)
+        self.assertEqual(model.shapes, [(100, 200, 3), (192, 384, 3)])
+        self.assertEqual(box.shape, (100, 200))
+        np.testing.assert_array_equal(box, expected)
+        self.assertEqual(box[26:75, 51:150].min(), 2)
+        self.assertEqual(box[:24].max(), 1)
+
+
+def float_layout_mask(page_layout, h, w):
+    """The float64 mask layout_mask built before it switched to small integers."""
+    box = np.ones((h, w))
+    vcls = ["abandon", "figure", "table", "isolate_formula", "formula_caption"]
+    for i, d in enumerate(page_layout.boxes):
+        if page_layout.names[int(d.cls)] not in vcls:
+            x0, y0, x1, y1 = d.xyxy.squeeze()
+            x0, y0, x1, y1 = (
+                np.clip(int(x0 - 1), 0, w - 1),
+                np.clip(int(h - y1 - 1), 0, h - 1),
+                np.clip(int(x1 + 1), 0, w - 1),
+                np.clip(int(h - y0 + 1), 0, h - 1),
+            )
+            box[y0:y1, x0:x1] = i + 2
+    for i, d in enumerate(page_layout.boxes):
+        if page_layout.names[int(d.cls)] in vcls:
+            x0, y0, x1, y1 = d.xyxy.squeeze()
+            x0, y0, x1, y1 = (
+                np.clip(int(x0 - 1), 0, w - 1),
+                np.clip(int(h - y1 - 1), 0, h - 1),
+                np.clip(int(x1 + 1), 0, w - 1),
+                np.clip(int(h - y0 + 1), 0, h - 1),
+            )
+            box[y0:y1, x0:x1] = 0
+    return box
+
+
+class TestLayoutMask(unittest.TestCase):
+    @staticmethod
+    def grid_layout(count: int) -> YoloResult:
+        # 20x20 的网格，每格一个框，每 7 个框有一个图片框
+        boxes = []
+        for i in range(count):
+            y, x = divmod(i, 20)
+            xyxy = [x * 20 + 4, y * 20 + 4, x * 20 + 16, y * 20 + 16]
+            boxes.append(xyxy + [1 - i / 1000, i % 7 == 0])
+        return YoloResult(boxes=np.array(boxes), names=StubModel.names)
+
+    def check(self, count: int, dtype):
+        page_layout = self.grid_layout(count)
+        box = layout_mask(page_layout, 400, 400)
+        self.assertEqual(box.dtype, dtype)
+        expected = float_layout_mask(page_layout, 400, 400)
+        np.testing.assert_array_equal(box, expected)
+        # 文本框的序号没有溢出
+        last = max(i for i in range(count) if i % 7)
+        self.assertEqual(box.max(), last + 2)
+        self.assertIn(0, box)
+
+    def test_uint8(self):
+        self.check(253, np.uint8)
+
+    def test_uint16(self):
+        self.check(254, np.uint16)
+        self.check(260, np.uint16)  # 序号超过 255
+        self.check(300, np.uint16)
+
+
+def fake_translate(self, text):
+    return "译" + text.upper()
+
+
+class TestTranslatePatch(unittest.TestCase):
+    def setUp(self):
+        self.test_db = cache.init_test_db()
+        folder = tempfile.TemporaryDirectory()
+        self.addCleanup(folder.cleanup)
+        # pymupdf 自带的 CJK 字体，避免下载字体
+        self.font_path = os.path.join(folder.name, "cjk.ttf")
+        with open(self.font_path, "wb") as f:
+            f.write(pymupdf.Font("china-s").buffer)
+        # 测试文件合并成一个多页文档
+        doc = pymupdf.open()
+        for name in ["plain.text", "text.with.figure"] * 2:
+            doc.insert_pdf(pymupdf.open(f"test/file/translate.cli.{name}.pdf"))
+        self.stream = doc.tobytes()
+
+    def tearDown(self):
+        cache.clean_test_db(self.test_db)
+
+    def translate_patch(self, **kwargs) -> dict:
+        patches = []
+        translate_patch = high_level.translate_patch
+
+        def capture(*args, **kwargs):
+            patches.append(translate_patch(*args, **kwargs))
+            return patches[-1]
+
+        with (
+            mock.patch.object(
+                high_level, "download_remote_fonts", return_value=self.font_path
+            ),
+            mock.patch.object(high_level, "translate_patch", capture),
+        ):
+            high_level.translate_stream(
+                self.stream,
+                lang_in="en",
+                lang_out="zh",
+                service="google",
+                thread=2,
+                model=StubModel(),
+                ignore_cache=True,
+                **kwargs,
+            )
+        return patches[0]
+
+    @unittest.skipUnless(
+        hasattr(os, "fork"), "page workers inherit the fake translator"
+    )
+    def test_page_workers(self):
+        get_context = multiprocessing.get_context
+        with mock.patch.object(GoogleTranslator, "do_translate", fake_translate):
+            serial = self.translate_patch()
+            # fork 让子进程继承替换后的翻译函数
+            with mock.patch.object(
+                high_level.multiprocessing,
+                "get_context",
+                lambda method=None: get_context("fork"),
+            ):
+                parallel = self.translate_patch(page_workers=2)
+        self.assertGreaterEqual(len(serial), 4)  # 每页一个指令流，另有 form xobject
+        self.assertEqual(list(parallel), list(serial))
+        self.assertEqual(parallel, serial)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest import mock
+
+import httpx
+import openai
+
+from pdf2zh import ratelimit
+from pdf2zh.ratelimit import RateLimiter, get_limiter, is_rate_limited
+
+
+def rate_limit_error():
+    request = httpx.Request("POST", "https://example.com")
+    response = httpx.Response(429, request=request, headers={"retry-after": "2"})
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_requests_per_second(self):
+        limiter = RateLimiter(rps=2)
+        delays = [limiter.reserve() for _ in range(4)]
+        # A burst of rps requests is allowed, then one every 1/rps seconds
+        self.assertAlmostEqual(delays[0], 0, places=2)
+        self.assertAlmostEqual(delays[1], 0, places=2)
+        self.assertAlmostEqual(delays[2], 0.5, places=2)
+        self.assertAlmostEqual(delays[3], 1.0, places=2)
+
+    def test_tokens_per_minute(self):
+        limiter = RateLimiter(tpm=600)
+        self.assertAlmostEqual(limiter.reserve(600), 0, places=2)
+        self.assertAlmostEqual(limiter.reserve(60), 6, places=2)
+
+    def test_unlimited(self):
+        limiter = RateLimiter()
+        for _ in range(100):
+            self.assertEqual(limiter.reserve(1000), 0)
+
+    def test_adaptive_concurrency(self):
+        limiter = RateLimiter(concurrency=8, cooldown=0)
+        for _ in range(4):
+            limiter.acquire()
+        with self.assertRaises(openai.RateLimitError):
+            with limiter.request():
+                raise rate_limit_error()
+        self.assertEqual(limiter.limit, 2.5)
+        self.assertEqual(limiter.inflight, 4)
+        self.assertGreater(limiter.paused_until, time.monotonic() + 1)
+        for _ in range(4):
+            limiter.release()
+        self.assertGreater(limiter.limit, 2.5)
+        self.assertLess(limiter.limit, 8)
+
+    def test_concurrency_blocks(self):
+        limiter = RateLimiter(concurrency=1)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+
+        threading.Thread(target=acquire).start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release()
+        self.assertTrue(acquired.wait(1))
+        limiter.release()
+
+    def test_async_concurrency(self):
+        limiter = RateLimiter(concurrency=2)
+        running = []
+
+        async def request():
+            async with limiter.arequest():
+                running.append(limiter.inflight)
+                await asyncio.sleep(0.01)
+
+        async def main():
+            await asyncio.gather(*(request() for _ in range(10)))
+
+        asyncio.run(main())
+        self.assertEqual(len(running), 10)
+        self.assertLessEqual(max(running), 2)
+        self.assertEqual(limiter.inflight, 0)
+
+    def test_is_rate_limited(self):
+        self.assertTrue(is_rate_limited(rate_limit_error()))
+        response = httpx.Response(429, request=httpx.Request("GET", "https://a"))
+        self.assertTrue(
+            is_rate_limited(httpx.HTTPStatusError("", request=None, response=response))
+        )
+        self.assertFalse(is_rate_limited(ValueError("error")))
+
+    def test_get_limiter(self):
+        config = {"test_limited": {"rps": 3, "concurrency": 4}}
+        with mock.patch.object(ratelimit.ConfigManager, "get", return_value=config):
+            limiter = get_limiter("test_limited")
+            self.assertIs(get_limiter("test_limited"), limiter)
+            self.assertEqual(limiter.rps, 3)
+            self.assertEqual(limiter.max_concurrency, 4)
+            self.assertEqual(get_limiter("test_unlimited").rps, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,12 +1,22 @@
+import asyncio
 import unittest
 from textwrap import dedent
 from unittest import mock
 
+import httpx
+import openai
 from ollama import ResponseError as OllamaResponseError
+from tenacity import wait_none
 
 from pdf2zh import cache
 from pdf2zh.config import ConfigManager
-from pdf2zh.translator import BaseTranslator, OllamaTranslator, OpenAIlikedTranslator
+from pdf2zh.translator import (
+    BaseTranslator,
+    BingTranslator,
+    OllamaTranslator,
+    OpenAIlikedTranslator,
+    ZhipuTranslator,
+)
 
 # Since it is necessary to test whether the functionality meets the expected requirements,
 # private functions and private methods are allowed to be called.
@@ -22,6 +32,20 @@ class AutoIncreaseTranslator(BaseTranslator):
         return str(self.n)
 
 
+class BatchTranslator(BaseTranslator):
+    name = "batch"
+    batch_size = 2
+    batch_chars = 10
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.requests = []
+
+    def do_translate_batch(self, texts):
+        self.requests.append(texts)
+        return [text.upper() for text in texts]
+
+
 class TestTranslator(unittest.TestCase):
     def setUp(self):
         self.test_db = cache.init_test_db()
@@ -77,6 +101,72 @@ class TestTranslator(unittest.TestCase):
         another_result = translator.translate(text)
         self.assertNotEqual(second_result, another_result)
 
+    def test_translate_batch(self):
+        translator = AutoIncreaseTranslator("en", "zh", "test", False)
+        first = translator.translate("Hello")
+        # Cached texts are answered from the cache, the rest fall back to do_translate
+        self.assertEqual(
+            translator.translate_batch(["Hello", "World", "Again"]),
+            [first, "2", "3"],
+        )
+        self.assertEqual(translator.translate("World"), "2")
+
+    def test_translate_batch_native(self):
+        translator = BatchTranslator("en", "zh", "test", False)
+        translator.translate_batch(["hello"])
+        self.assertEqual(
+            translator.translate_batch(["hello", "a", "b"]), ["HELLO", "A", "B"]
+        )
+        self.assertEqual(translator.requests, [["hello"], ["a", "b"]])
+        self.assertEqual(translator.translate_batch(["a", "b"]), ["A", "B"])
+        self.assertEqual(len(translator.requests), 2)
+
+    def test_translate_batch_mismatch(self):
+        translator = BatchTranslator("en", "zh", "test", False)
+        translator.do_translate_batch = lambda texts: texts[:1]
+        translator.do_translate = str.upper
+        # A short batch response falls back to one request per text
+        with self.assertLogs("pdf2zh.translator", "WARNING"):
+            self.assertEqual(translator.translate_batch(["a", "b"]), ["A", "B"])
+
+    def test_split_batches(self):
+        translator = BatchTranslator("en", "zh", "test", False)
+        self.assertEqual(
+            translator.split_batches(["a", "b", "c", "0123456789", "d"]),
+            [["a", "b"], ["c"], ["0123456789"], ["d"]],
+        )
+
+    def test_parse_batch_response(self):
+        parse = BaseTranslator.parse_batch_response
+        self.assertEqual(parse('["你好", " 世界 "]', 2), ["你好", "世界"])
+        self.assertEqual(parse('```json\n["你好"]\n```', 1), ["你好"])
+        self.assertIsNone(parse('["你好"]', 2))
+        self.assertIsNone(parse("1. 你好", 1))
+
+    def test_atranslate(self):
+        translator = AutoIncreaseTranslator("en", "zh", "test", False)
+        first = translator.translate("Hello")
+        # Without a native async client, do_translate runs in a thread
+        self.assertEqual(asyncio.run(translator.atranslate("Hello")), first)
+        self.assertEqual(asyncio.run(translator.atranslate("World")), "2")
+        self.assertEqual(
+            asyncio.run(translator.atranslate_batch(["World", "Again"])), ["2", "3"]
+        )
+
+    def test_atranslate_batch_native(self):
+        translator = BatchTranslator("en", "zh", "test", False)
+        self.assertEqual(
+            asyncio.run(translator.atranslate_batch(["a", "b"])), ["A", "B"]
+        )
+        self.assertEqual(translator.requests, [["a", "b"]])
+
+    def test_new_aclient(self):
+        # 与 requests 一样不设超时
+        translator = AutoIncreaseTranslator("en", "zh", "test", False)
+        self.assertIsNone(translator.new_aclient().timeout.read)
+        bing = BingTranslator("en", "zh", "test")
+        self.assertIsNone(bing.new_aclient().timeout.read)
+
     def test_base_translator_throw(self):
         translator = BaseTranslator("en", "zh", "test", False)
         with self.assertRaises(NotImplementedError):
@@ -152,6 +242,123 @@ class TestOpenAIlikedTranslator(unittest.TestCase):
         self.assertIsNone(translator.envs["OPENAILIKED_API_KEY"])
 
 
+class TestOpenAITranslatorCache(unittest.TestCase):
+    def setUp(self):
+        self.test_db = cache.init_test_db()
+        ConfigManager.clear()
+        self.translator = OpenAIlikedTranslator(
+            "en",
+            "zh",
+            None,
+            envs={
+                "OPENAILIKED_BASE_URL": "https://api.openailiked.com",
+                "OPENAILIKED_MODEL": "test_model",
+            },
+        )
+
+    def tearDown(self):
+        cache.clean_test_db(self.test_db)
+
+    def test_params_key(self):
+        """测试批量翻译不改变逐条翻译的缓存参数"""
+        params = {
+            "lang_in": "en",
+            "lang_out": "zh",
+            "model": "test_model",
+            "prompt": self.translator.prompt("", None),
+            "temperature": 0,
+            "think_filter_regex": r"^<think>.+?\n*(</think>|\n)*(</think>)\n*",
+        }
+        expected = cache.TranslationCache("openailiked", params).params_key
+        self.assertEqual(self.translator.cache.params_key, expected)
+        zhipu = ZhipuTranslator("en", "zh", None, envs={"ZHIPU_API_KEY": "key"})
+        self.assertEqual(zhipu.batch_size, 1)
+        self.assertNotIn("batch_prompt", zhipu.cache.params)
+        self.assertNotEqual(self.translator.get_batch_cache().params_key, expected)
+
+    def test_batch_cache(self):
+        """测试批量 prompt 的译文单独缓存，逐条翻译的缓存仍然命中"""
+        self.translator.cache.set("hello", "你好")
+        self.translator.do_translate_batch = lambda texts: [t.upper() for t in texts]
+        self.assertEqual(
+            self.translator.translate_batch(["hello", "a", "b"]), ["你好", "A", "B"]
+        )
+        self.assertIsNone(self.translator.cache.get("a"))
+        self.assertEqual(self.translator.get_batch_cache().get("a"), "A")
+        self.assertEqual(
+            self.translator.lookup_batch(["hello", "a", "c"]),
+            (["你好", "A", None], [2]),
+        )
+        # 自定义 prompt 逐条翻译，译文写入同一个缓存
+        self.translator.prompttext = "custom"
+        self.assertIs(self.translator.get_batch_cache(), self.translator.cache)
+
+
+class TestZhipuTranslator(unittest.TestCase):
+    def setUp(self):
+        ConfigManager.clear()
+        self.translator = ZhipuTranslator(
+            "en", "zh", None, envs={"ZHIPU_API_KEY": "test_api_key"}
+        )
+
+    def test_content_filter_error(self):
+        """测试内容审核错误（1301）返回占位译文"""
+        request = httpx.Request("POST", "https://open.bigmodel.cn/api/paas/v4")
+        error = openai.BadRequestError(
+            "Error code: 400",
+            response=httpx.Response(400, request=request),
+            body={"code": "1301", "message": "contentFilter"},
+        )
+        client = mock.AsyncMock()
+        client.chat.completions.create.side_effect = error
+        with mock.patch.object(self.translator, "get_aclient", return_value=client):
+            self.assertEqual(
+                asyncio.run(self.translator.ado_translate("Hello")),
+                "IRREPARABLE TRANSLATION ERROR",
+            )
+        with mock.patch.object(
+            self.translator.client.chat.completions, "create", side_effect=error
+        ):
+            self.assertEqual(
+                self.translator.do_translate("Hello"), "IRREPARABLE TRANSLATION ERROR"
+            )
+
+    def test_rate_limit_retry(self):
+        """测试异步翻译和同步翻译一样在限流时重试"""
+        request = httpx.Request("POST", "https://open.bigmodel.cn/api/paas/v4")
+        error = openai.RateLimitError(
+            "Error code: 429",
+            response=httpx.Response(429, request=request),
+            body=None,
+        )
+        response = mock.Mock()
+        response.choices = [mock.Mock()]
+        response.choices[0].message.content = " 你好 "
+        client = mock.AsyncMock()
+        client.chat.completions.create.side_effect = [error, response]
+        ado_translate = ZhipuTranslator.ado_translate.retry_with(wait=wait_none())
+        with mock.patch.object(self.translator, "get_aclient", return_value=client):
+            self.assertEqual(
+                asyncio.run(ado_translate(self.translator, "Hello")), "你好"
+            )
+        self.assertEqual(client.chat.completions.create.await_count, 2)
+
+    def test_new_aclient(self):
+        """测试异步客户端沿用同步客户端的配置"""
+        self.translator.client = openai.OpenAI(
+            base_url="https://open.bigmodel.cn/api/paas/v4",
+            api_key="test_api_key",
+            timeout=30,
+            max_retries=5,
+            default_headers={"X-Test": "1"},
+        )
+        aclient = self.translator.new_aclient()
+        self.assertEqual(aclient.base_url, self.translator.client.base_url)
+        self.assertEqual(aclient.timeout, 30)
+        self.assertEqual(aclient.max_retries, 5)
+        self.assertEqual(aclient.default_headers["X-Test"], "1")
+
+
 class TestOllamaTranslator(unittest.TestCase):
     def test_do_translate(self):
         translator = OllamaTranslator(lang_in="en", lang_out="zh", model="test:3b")